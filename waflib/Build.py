@@ -13,6 +13,9 @@ The class Build holds all the info related to a build:
 import os, sys, errno, re, datetime, shutil
 try: import cPickle
 except: import pickle as cPickle
+try: import sqlite3
+except ImportError: sqlite3 = None
+from io import BytesIO
 from waflib import Runner, TaskGen, Utils, ConfigSet, Task, Logs, Options, Context, Errors
 import waflib.Node
 
@@ -28,9 +31,18 @@ INSTALL = 1337
 UNINSTALL = -1337
 """negative value '<-' uninstall"""
 
-SAVED_ATTRS = 'root node_deps raw_deps task_sigs'.split()
+SAVED_ATTRS = 'root node_deps raw_deps task_sigs task_times file_sigs'.split()
 """Build class members to save"""
 
+DB_SQLITE = True
+"""store the build data in a sqlite database updated incrementally (Context.SQLITE_DBFILE) if the module sqlite3 is available, else pickle everything (Context.DBFILE)"""
+
+DB_BATCH = 500
+"""maximum amount of keys per query when reading the entries used by a build group"""
+
+DB_COMPACT = 0.25
+"""proportion of free pages in the sqlite database above which the file is compacted during the build"""
+
 CFG_FILES = 'cfg_files'
 """files from the build directory to hash before starting the build"""
 
@@ -43,6 +55,341 @@ POST_LAZY = 1
 POST_BOTH = 2
 """post mode: post the task generators at once, then re-check them for each group"""
 
+class db_table(dict):
+	"""
+	Build data kept in a table of the sqlite database (see sqlite_store): the entries are read
+	when they are requested, and only the entries added, modified or removed are written.
+	The values that may be modified in place (lists) are compared to a copy when saving.
+	"""
+	def __init__(self, store, name, mutable=False):
+		dict.__init__(self)
+		self.store = store
+		self.name = name
+		self.mutable = mutable
+		self.absent = set([])
+		self.dirty = set([])
+		self.removed = set([])
+		self.orig = {}
+
+	def loaded(self, key, val):
+		"entry read from the database"
+		dict.__setitem__(self, key, val)
+		if self.mutable:
+			if isinstance(val, list):
+				self.orig[key] = list(val)
+			else:
+				self.orig[key] = val
+
+	def __missing__(self, key):
+		if not key in self.absent:
+			self.store.fetch(self, [key])
+			if dict.__contains__(self, key):
+				return dict.__getitem__(self, key)
+		raise KeyError(key)
+
+	def __contains__(self, key):
+		try:
+			self[key]
+		except KeyError:
+			return False
+		return True
+
+	def get(self, key, default=None):
+		try:
+			return self[key]
+		except KeyError:
+			return default
+
+	def __setitem__(self, key, val):
+		dict.__setitem__(self, key, val)
+		self.dirty.add(key)
+		self.absent.discard(key)
+		self.removed.discard(key)
+
+	def __delitem__(self, key):
+		self[key]
+		dict.__delitem__(self, key)
+		self.dirty.discard(key)
+		self.removed.add(key)
+		self.absent.add(key)
+
+	def pop(self, key, *k):
+		try:
+			val = self[key]
+		except KeyError:
+			if k:
+				return k[0]
+			raise
+		del self[key]
+		return val
+
+	def setdefault(self, key, val):
+		try:
+			return self[key]
+		except KeyError:
+			self[key] = val
+			return val
+
+	def changed(self):
+		"keys of the entries to write"
+		ret = set(self.dirty)
+		for (k, v) in self.orig.items():
+			if dict.__contains__(self, k) and dict.__getitem__(self, k) != v:
+				ret.add(k)
+		return ret
+
+class sqlite_store(object):
+	"""
+	Build database in sqlite, one table of (key, value) for each attribute in SAVED_ATTRS (see db_table).
+	The node tree is not saved: the nodes are stored by path, and the signatures of the build nodes
+	are kept in the table node_sigs. The entries used by the tasks of a build group are read by a few
+	queries when the group is posted (see prefetch), so that only the data of the targets built is loaded.
+	"""
+
+	tables = {'task_sigs': False, 'node_deps': True, 'raw_deps': True, 'task_times': False, 'file_sigs': False}
+	"""tables read lazily -> values modified in place"""
+
+	def __init__(self, bld, path):
+		self.bld = bld
+		self.path = path
+		self.lock = Utils.threading.Lock()
+		self.nodes = {}
+		self.node_sigs = {}
+		self.compact_thread = None
+
+		self.conn = sqlite3.connect(path, check_same_thread=False)
+		self.conn.text_factory = str
+		self.conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+		self.conn.execute('PRAGMA journal_mode=WAL')
+		self.conn.execute('PRAGMA synchronous=NORMAL')
+		for x in list(self.tables.keys()) + ['node_sigs', 'meta']:
+			self.conn.execute('CREATE TABLE IF NOT EXISTS %s (k BLOB PRIMARY KEY, v BLOB)' % x)
+
+		# the signatures cannot be compared if the hash function changes
+		fmt = '%s %d' % (Utils.hash_engine, cPickle.HIGHEST_PROTOCOL)
+		row = self.conn.execute("SELECT v FROM meta WHERE k='format'").fetchone()
+		if not row or row[0] != fmt:
+			Logs.debug('build: new build database (format %r)' % fmt)
+			self.clear()
+			self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('format', ?)", (fmt,))
+		self.conn.commit()
+
+		for (name, mutable) in self.tables.items():
+			setattr(bld, name, db_table(self, name, mutable))
+
+		free = self.conn.execute('PRAGMA freelist_count').fetchone()[0]
+		if free > DB_COMPACT * self.conn.execute('PRAGMA page_count').fetchone()[0]:
+			self.compact_thread = Utils.threading.Thread(target=self.compact)
+			self.compact_thread.start()
+
+	def clear(self):
+		"remove all the entries"
+		for x in list(self.tables.keys()) + ['node_sigs']:
+			self.conn.execute('DELETE FROM %s' % x)
+		self.node_sigs = {}
+		self.nodes = {}
+
+	def compact(self):
+		"release the free pages, in a thread during the build (see save)"
+		conn = sqlite3.connect(self.path)
+		try:
+			conn.execute('PRAGMA incremental_vacuum')
+			conn.commit()
+		except sqlite3.Error as e:
+			Logs.debug('build: could not compact the database %r' % e)
+		conn.close()
+
+	def persistent_id(self, obj):
+		if isinstance(obj, waflib.Node.Node):
+			return obj.abspath()
+		return None
+
+	def persistent_load(self, path):
+		try:
+			return self.nodes[path]
+		except KeyError:
+			ret = self.nodes[path] = self.bld.root.make_node(path)
+			return ret
+
+	def dumps(self, obj):
+		f = BytesIO()
+		p = cPickle.Pickler(f, cPickle.HIGHEST_PROTOCOL)
+		p.persistent_id = self.persistent_id
+		p.dump(obj)
+		return f.getvalue()
+
+	def loads(self, data):
+		u = cPickle.Unpickler(BytesIO(data))
+		u.persistent_load = self.persistent_load
+		return u.load()
+
+	def query(self, name, keys):
+		"rows of a table for a list of keys"
+		ret = []
+		for i in range(0, len(keys), DB_BATCH):
+			lst = keys[i:i+DB_BATCH]
+			sql = 'SELECT k, v FROM %s WHERE k IN (%s)' % (name, ','.join('?' * len(lst)))
+			ret.extend(self.conn.execute(sql, lst).fetchall())
+		return ret
+
+	def fetch(self, table, keys):
+		"read the entries of a db_table which are not known yet"
+		enc = {}
+		for k in keys:
+			if not dict.__contains__(table, k) and not k in table.absent:
+				enc[self.dumps(k)] = k
+		if not enc:
+			return
+		self.lock.acquire()
+		try:
+			for (k, v) in self.query(table.name, [sqlite3.Binary(x) for x in enc.keys()]):
+				table.loaded(enc.pop(bytes(k)), self.loads(bytes(v)))
+		finally:
+			self.lock.release()
+		table.absent.update(enc.values())
+
+	def fetch_sigs(self, nodes):
+		"set the signatures of the build nodes from the table node_sigs"
+		paths = {}
+		for x in nodes:
+			try:
+				x.sig
+			except AttributeError:
+				paths[x.abspath()] = x
+		keys = [k for k in paths if not k in self.node_sigs]
+		if keys:
+			self.lock.acquire()
+			try:
+				for (k, v) in self.query('node_sigs', keys):
+					self.node_sigs[k] = bytes(v)
+			finally:
+				self.lock.release()
+			for k in keys:
+				if not k in self.node_sigs:
+					self.node_sigs[k] = None
+		for (k, x) in paths.items():
+			sig = self.node_sigs[k]
+			if sig is not None:
+				x.sig = sig
+
+	def prefetch(self, tasks):
+		"read the entries used by the tasks of a build group"
+		bld = self.bld
+		uids = []
+		nodes = set([])
+		for tsk in tasks:
+			# the uid is computed only once: skip the tasks whose inputs may be set later
+			# (in runnable_status), their entries are read when they are used
+			if not getattr(tsk, 'inputs', None):
+				continue
+			uids.append(tsk.uid())
+			nodes.update(tsk.inputs + tsk.outputs + getattr(tsk, 'dep_nodes', []))
+		if not uids:
+			return
+
+		self.fetch(bld.task_sigs, uids + [(x, 'imp') for x in uids])
+		self.fetch(bld.task_times, uids)
+		self.fetch(bld.raw_deps, uids)
+		self.fetch(bld.node_deps, uids)
+		for x in uids:
+			lst = bld.node_deps.get(x, None)
+			if isinstance(lst, list):
+				nodes.update(lst)
+
+		src = []
+		out = []
+		for x in nodes:
+			if x.is_bld():
+				out.append(x)
+			else:
+				src.append(x)
+		self.fetch(bld.file_sigs, src)
+		self.fetch_sigs(out)
+
+	def prune(self, name, keys):
+		"remove the rows of a table which are not in the list of keys given"
+		conn = self.conn
+		if conn.execute('SELECT COUNT(*) FROM %s' % name).fetchone()[0] <= len(keys):
+			return
+		conn.execute('CREATE TEMP TABLE IF NOT EXISTS used (k BLOB PRIMARY KEY)')
+		conn.execute('DELETE FROM used')
+		conn.executemany('INSERT OR IGNORE INTO used VALUES (?)', [(x,) for x in keys])
+		conn.execute('DELETE FROM %s WHERE k NOT IN (SELECT k FROM used)' % name)
+		conn.execute('DELETE FROM used')
+
+	def save(self):
+		"""
+		write the entries modified; when the whole build was processed, the rows which
+		were not used (tasks and files which do not exist anymore) are removed
+		"""
+		if self.compact_thread:
+			self.compact_thread.join()
+			self.compact_thread = None
+
+		bld = self.bld
+		bin = sqlite3.Binary
+		self.lock.acquire()
+		try:
+			conn = self.conn
+			reset = False
+			for name in self.tables:
+				table = getattr(bld, name)
+				if not isinstance(table, db_table):
+					# replaced by another dict (BuildContext.clean)
+					reset = True
+			if reset:
+				self.clear()
+
+			for name in self.tables:
+				table = getattr(bld, name)
+				if isinstance(table, db_table):
+					keys = table.changed()
+					conn.executemany('DELETE FROM %s WHERE k=?' % name, [(bin(self.dumps(k)),) for k in table.removed])
+				else:
+					keys = list(table.keys())
+				if keys:
+					conn.executemany('INSERT OR REPLACE INTO %s VALUES (?, ?)' % name,
+						[(bin(self.dumps(k)), bin(self.dumps(table[k]))) for k in keys])
+				if isinstance(table, db_table):
+					table.dirty = set([])
+					table.removed = set([])
+					if table.mutable:
+						for k in keys:
+							table.loaded(k, dict.__getitem__(table, k))
+				else:
+					new = db_table(self, name, self.tables[name])
+					for (k, v) in table.items():
+						new.loaded(k, v)
+					setattr(bld, name, new)
+
+			# the signatures of the build nodes, the tree is not saved
+			if not reset:
+				rows = []
+				paths = []
+				stack = [bld.bldnode]
+				while stack:
+					node = stack.pop()
+					stack.extend(getattr(node, 'children', {}).values())
+					try:
+						sig = node.sig
+					except AttributeError:
+						continue
+					path = node.abspath()
+					paths.append(path)
+					if self.node_sigs.get(path, None) != sig:
+						self.node_sigs[path] = sig
+						rows.append((path, bin(sig)))
+				conn.executemany('INSERT OR REPLACE INTO node_sigs VALUES (?, ?)', rows)
+
+				if bld.is_complete():
+					for name in self.tables:
+						self.prune(name, [bin(self.dumps(k)) for k in dict.keys(getattr(bld, name))])
+					self.prune('node_sigs', paths)
+					self.node_sigs = dict((x, self.node_sigs[x]) for x in paths)
+			conn.commit()
+		finally:
+			self.lock.release()
+
 class BuildContext(Context.Context):
 	'''executes the build'''
 
@@ -72,9 +419,12 @@ class BuildContext(Context.Context):
 		# ======================================= #
 		# cache variables
 
-		for v in 'task_sigs node_deps raw_deps'.split():
+		for v in 'task_sigs node_deps raw_deps task_times file_sigs'.split():
 			setattr(self, v, {})
 
+		self.store = None
+		"""sqlite database (see sqlite_store), or None if the build data is pickled"""
+
 		# list of folders that are already scanned
 		# so that we do not need to stat them one more time
 		self.cache_dir_contents = {}
@@ -196,7 +546,7 @@ class BuildContext(Context.Context):
 		self.post_build()
 
 	def load(self):
-		"Loads the cache from the disk (pickle)"
+		"Loads the cache from the disk (sqlite or pickle)"
 		try:
 			env = ConfigSet.ConfigSet(os.path.join(self.cache_dir, 'build.config.py'))
 		except (IOError, OSError):
@@ -207,6 +557,17 @@ class BuildContext(Context.Context):
 			for t in env['tools']:
 				self.setup(**t)
 
+		if DB_SQLITE and sqlite3:
+			try:
+				Utils.check_dir(self.variant_dir)
+				self.store = sqlite_store(self, os.path.join(self.variant_dir, Context.SQLITE_DBFILE))
+			except sqlite3.Error as e:
+				Logs.warn('Could not open the build database, using pickle (%s)' % e)
+				self.store = None
+			else:
+				self.init_dirs()
+				return
+
 		f = None
 		try:
 			try:
@@ -219,12 +580,25 @@ class BuildContext(Context.Context):
 					waflib.Node.pickle_lock.acquire()
 					waflib.Node.Nod3 = self.node_class
 					try:
-						data = cPickle.load(f)
+						# the node tree first (see save), then the data referencing the nodes by index
+						head = cPickle.load(f)
+						if head.get('hash_engine', 'md5') != Utils.hash_engine:
+							# the signatures cannot be compared
+							Logs.debug('build: the hash function changed to %r, the build cache is ignored' % Utils.hash_engine)
+							data = None
+						else:
+							tree = self.node_class.lazy_tree = waflib.Node.lazy_tree(head['tree'], self.node_class)
+							u = cPickle.Unpickler(f)
+							u.persistent_load = tree.get_node
+							data = u.load()
 					except Exception as e:
 						Logs.debug('build: could not load the build cache %r' % e)
 					else:
-						for x in SAVED_ATTRS:
-							setattr(self, x, data[x])
+						if data:
+							self.root = tree.root
+							for x in SAVED_ATTRS:
+								if x != 'root':
+									setattr(self, x, data[x])
 				finally:
 					waflib.Node.pickle_lock.release()
 		finally:
@@ -234,21 +608,40 @@ class BuildContext(Context.Context):
 		self.init_dirs()
 
 	def save(self):
-		"Stores the cache on disk (pickle), see self.load - uses a temporary file to avoid problems with ctrl+c"
+		"Stores the cache on disk (sqlite or pickle), see self.load - uses a temporary file to avoid problems with ctrl+c"
+
+		for m in getattr(self, 'save_funs', []):
+			m(self)
+
+		if self.store:
+			self.store.save()
+			return
+
+		if self.is_complete():
+			self.prune_data()
 
 		data = {}
 		for x in SAVED_ATTRS:
-			data[x] = getattr(self, x)
+			if x != 'root':
+				data[x] = getattr(self, x)
 		db = os.path.join(self.variant_dir, Context.DBFILE)
 
 		try:
 			waflib.Node.pickle_lock.acquire()
 			waflib.Node.Nod3 = self.node_class
 
+			# the node tree is stored as flat arrays, the folders not loaded are copied (see Node.flatten)
+			(tree, index) = waflib.Node.flatten(self.root)
+			def persistent_id(obj):
+				return index.get(id(obj), None)
+
 			f = None
 			try:
 				f = open(db + '.tmp', 'wb')
-				cPickle.dump(data, f)
+				cPickle.dump({'hash_engine': Utils.hash_engine, 'tree': tree}, f, -1)
+				p = cPickle.Pickler(f, -1)
+				p.persistent_id = persistent_id
+				p.dump(data)
 			finally:
 				if f:
 					f.close()
@@ -260,12 +653,44 @@ class BuildContext(Context.Context):
 		except OSError: pass
 		os.rename(db + '.tmp', db)
 
+	def is_complete(self):
+		"True if all the targets were processed: the build data not used may be removed"
+		if self.targets and self.targets != '*':
+			return False
+		if getattr(self, 'files', None):
+			return False
+		return getattr(self, 'cur', 0) >= len(self.groups)
+
+	def prune_data(self):
+		"""
+		remove the data of the tasks and of the files which are not used by the build from the
+		pickled build data (sqlite_store.save removes the rows which were not used)
+		"""
+		uids = set([])
+		nodes = set([])
+		for tsk in getattr(getattr(self, 'producer', None), 'loaded', []):
+			try:
+				uid = tsk.uid()
+			except AttributeError:
+				continue
+			uids.add(uid)
+			uids.add((uid, 'imp'))
+			lst = tsk.inputs + getattr(tsk, 'dep_nodes', []) + self.node_deps.get(uid, [])
+			nodes.update([id(x) for x in lst])
+		for t in (self.task_sigs, self.task_times, self.node_deps, self.raw_deps):
+			for x in list(t.keys()):
+				if not x in uids:
+					del t[x]
+		for x in list(self.file_sigs.keys()):
+			if not id(x) in nodes:
+				del self.file_sigs[x]
+
 	def compile(self):
 		"""The cache file is not written if nothing was build at all (build is up to date)"""
 		Logs.debug('build: compile()')
 
 		# use another object to perform the producer-consumer logic (reduce the complexity)
-		self.producer = Runner.Parallel(self, Options.options.jobs)
+		self.producer = Runner.Parallel(self, getattr(self, 'jobs', Options.options.jobs))
 		self.producer.biter = self.get_build_iterator()
 		try:
 			self.producer.start() # vroom
@@ -325,7 +750,7 @@ class BuildContext(Context.Context):
 
 	def hash_env_vars(self, env, vars_lst):
 		"""hash environment variables
-		['CXX', ..] -> [env['CXX'], ..] -> md5()
+		['CXX', ..] -> [env['CXX'], ..] -> hash (Utils.h_list)
 
 		cached by build context
 		"""
@@ -423,6 +848,13 @@ class BuildContext(Context.Context):
 		except AttributeError:
 			self.post_funs = [meth]
 
+	def add_save_fun(self, meth):
+		"""binds a method to be executed when the build data is saved, even if the build fails (see save)"""
+		try:
+			self.save_funs.append(meth)
+		except AttributeError:
+			self.save_funs = [meth]
+
 	def get_group(self, x):
 		"""get the group x (name or number), or the current group"""
 		if not self.groups:
@@ -566,6 +998,10 @@ class BuildContext(Context.Context):
 			Task.set_file_constraints(tasks)
 			Task.set_precedence_constraints(tasks)
 
+			if self.store:
+				self.store.prefetch(tasks)
+			self.prefetch_sigs(tasks)
+
 			self.cur += 1
 			if not tasks: # return something else the build will stop
 				continue
@@ -574,6 +1010,54 @@ class BuildContext(Context.Context):
 			yield []
 
 
+	def prefetch_sigs(self, tasks):
+		"""
+		compute the signatures of the source files used by the tasks (inputs, dep_nodes,
+		dependencies found by the scanners on the previous build) in several threads,
+		instead of reading the files one after the other in Task.runnable_status
+		"""
+		numjobs = getattr(getattr(self, 'producer', None), 'numjobs', 1)
+		if numjobs < 2:
+			return
+
+		try:
+			cache = self.hash_cache
+		except AttributeError:
+			cache = self.hash_cache = {}
+
+		seen = set([])
+		nodes = []
+		for tsk in tasks:
+			# the uid is computed once, not before the inputs are known (see sqlite_store.prefetch)
+			if not getattr(tsk, 'inputs', None):
+				continue
+			lst = tsk.inputs + getattr(tsk, 'dep_nodes', []) + self.node_deps.get(tsk.uid(), [])
+			for x in lst:
+				k = id(x)
+				if not k in cache and not k in seen:
+					seen.add(k)
+					if not x.is_bld():
+						nodes.append(x)
+		if len(nodes) < 2:
+			return
+
+		def sign(lst):
+			for x in lst:
+				try:
+					x.get_bld_sig()
+				except EnvironmentError:
+					# reported by the task using the file
+					pass
+
+		# the hash functions and the file system calls release the gil
+		threads = []
+		for i in range(min(numjobs, len(nodes))):
+			t = Utils.threading.Thread(target=sign, args=(nodes[i::numjobs],))
+			t.start()
+			threads.append(t)
+		for t in threads:
+			t.join()
+
 	def install_dir(self, path, env=None):
 		"""
 		create empty folders for the installation (very rarely used) TODO
@@ -613,12 +1097,19 @@ class inst_task(Task.Task):
 				buf.append(y)
 			self.set_inputs(buf)
 
-			bld = self.generator.bld
-			for tsk in bld.producer.outstanding + bld.producer.frozen:
-				for x in self.inputs:
-					if x in getattr(tsk, 'outputs', []):
-						self.set_run_after(tsk)
-						break
+			# the inputs have changed, a unique id computed previously is invalid
+			try:
+				del self.uid_
+			except AttributeError:
+				pass
+
+			# the tasks creating the files to install must be run first
+			producers = self.generator.bld.producer.producers
+			for x in self.inputs:
+				try:
+					self.set_run_after(producers[id(x)])
+				except KeyError:
+					pass
 
 		return super(inst_task, self).runnable_status()
 
@@ -693,9 +1184,20 @@ class InstallContext(BuildContext):
 				pass
 			else:
 				# same size and identical timestamps -> make no copy
-				if st1.st_mtime >= st2.st_mtime and st1.st_size == st2.st_size:
-					Logs.info('- install %s (from %s)' % (tgt, srclbl))
-					return False
+				if st1.st_size == st2.st_size:
+					if st1.st_mtime >= st2.st_mtime:
+						Logs.info('- install %s (from %s)' % (tgt, srclbl))
+						return False
+
+					# same contents -> update the timestamp only
+					try:
+						same = Utils.h_file(tgt) == Utils.h_file(src)
+					except (OSError, IOError):
+						same = False
+					if same:
+						os.utime(tgt, (st2.st_atime, st2.st_mtime))
+						Logs.info('- install %s (from %s)' % (tgt, srclbl))
+						return False
 
 		Logs.info('+ install %s (from %s)' % (tgt, srclbl))
 
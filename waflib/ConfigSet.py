@@ -10,10 +10,13 @@ There is one gotcha: getitem returns [] if the contents evals to False
 This means env['foo'] = {}; print env['foo'] will print [] not {}
 """
 
-import os, copy, re
+import os, sys, copy, re, marshal
 from waflib import Logs, Utils
 re_imp = re.compile('^(#)*?([^#=]*?)\ =\ (.*?)$', re.M)
 
+BIN_SUFFIX = '.bin'
+"""suffix of the binary copies of the files (see ConfigSet.store)"""
+
 class ConfigSet(object):
 	"""A dict that honor serialization and parent relationships
 	Store and retrieve values easily and in a human-readable format
@@ -170,28 +173,67 @@ class ConfigSet(object):
 			merged_table.update(table)
 		return merged_table
 
-	def store(self, filename):
-		"Write the variables into a file"
+	def store(self, filename, binary=False):
+		"""
+		Write the variables into a file; if binary is True, a copy is written in the marshal
+		format in filename + BIN_SUFFIX, and used by load while the text file does not change
+		"""
+		merged_table = self.get_merged_dict()
+		keys = list(merged_table.keys())
+		keys.sort()
+		code = ''.join(['%s = %r\n' % (k, merged_table[k]) for k in keys])
+
 		f = None
 		try:
 			f = open(filename, 'w')
-			merged_table = self.get_merged_dict()
-			keys = list(merged_table.keys())
-			keys.sort()
-			for k in keys:
-				f.write('%s = %r\n' % (k, merged_table[k]))
+			f.write(code)
 		finally:
 			if f:
 				f.close()
 
+		if binary:
+			try:
+				data = marshal.dumps((sys.hexversion, self.get_sig(code), merged_table))
+			except ValueError:
+				# not a python literal, the text file is parsed
+				Logs.debug('env: cannot marshal %r' % filename)
+			else:
+				f = None
+				try:
+					f = open(filename + BIN_SUFFIX, 'wb')
+					f.write(data)
+				finally:
+					if f:
+						f.close()
+
+	def get_sig(self, code):
+		"signature of the text file for the binary copy"
+		if not isinstance(code, bytes):
+			code = code.encode('utf-8')
+		return Utils.md5(code).digest()
+
+	def load_bin(self, filename, code):
+		"return the variables from the binary copy of a file, or None if it is missing or outdated"
+		try:
+			(ver, sig, tbl) = marshal.loads(Utils.readf(filename + BIN_SUFFIX, 'rb'))
+		except (EnvironmentError, EOFError, ValueError, TypeError):
+			return None
+		if ver != sys.hexversion or sig != self.get_sig(code):
+			return None
+		return tbl
+
 	def load(self, filename):
-		"Retrieve the variables from a file"
+		"Retrieve the variables from a file (or from its binary copy, see store)"
 		tbl = self.table
 		code = Utils.readf(filename)
-		for m in re_imp.finditer(code):
-			g = m.group
-			tbl[g(2)] = eval(g(3))
-		Logs.debug('env: %s' % str(self.table))
+		data = self.load_bin(filename, code)
+		if data is not None:
+			tbl.update(data)
+		else:
+			for m in re_imp.finditer(code):
+				g = m.group
+				tbl[g(2)] = eval(g(3))
+		Logs.debug('env: %s', self.table)
 
 	def update(self, d):
 		"""like dict.update, replace values from another dict"""
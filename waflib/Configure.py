@@ -20,6 +20,8 @@ Note: the c/c++ related code is in the module config_c
 """
 
 import os, shlex, sys, time
+try: import cPickle
+except ImportError: import pickle as cPickle
 from waflib import ConfigSet, Utils, Options, Logs, Context, Build, Errors
 
 try:
@@ -38,6 +40,9 @@ CONTINUE = 'continue'
 WAF_CONFIG_LOG = 'config.log'
 """name of the configuration log file"""
 
+CHECK_CACHE = '.conf_check_cache'
+"""results of the configuration tests, re-used by the next configuration (see ConfigurationContext.cache_check)"""
+
 autoconfig = False
 """execute the configuration automatically"""
 
@@ -117,6 +122,11 @@ class ConfigurationContext(Context.Context):
 
 		self.tool_cache = []
 
+		self.check_cache = {}
+		"""results of the configuration tests of the previous configuration"""
+		self.check_cache_new = {}
+		"""results of the configuration tests of this configuration"""
+
 	def post_init(self):
 		"""TODO remove this method, ugh"""
 		self.cachedir = os.path.join(self.bldnode.abspath(), Build.CACHE_DIR)
@@ -148,6 +158,12 @@ class ConfigurationContext(Context.Context):
 		abi = Context.ABI
 		self.to_log(conf_template % vars())
 
+		if not Options.options.no_conf_cache:
+			try:
+				self.check_cache = cPickle.loads(Utils.readf(os.path.join(self.bldnode.abspath(), CHECK_CACHE), 'rb'))
+			except (EnvironmentError, EOFError, ValueError, cPickle.UnpicklingError):
+				pass
+
 	def execute(self):
 		"""See Context.prepare"""
 		top = Options.options.top
@@ -231,7 +247,61 @@ class ConfigurationContext(Context.Context):
 			self.fatal('nothing to store in the configuration context!')
 		for key in self.all_envs:
 			tmpenv = self.all_envs[key]
-			tmpenv.store(os.path.join(self.cachedir, key + Build.CACHE_SUFFIX))
+			tmpenv.store(os.path.join(self.cachedir, key + Build.CACHE_SUFFIX), binary=True)
+
+		f = open(os.path.join(self.bldnode.abspath(), CHECK_CACHE), 'wb')
+		try:
+			cPickle.dump(self.check_cache_new, f, -1)
+		finally:
+			f.close()
+
+	def cache_check(self, key, fun, *k, **kw):
+		"""
+		return fun(*k, **kw), or the result obtained by the previous configuration for the same key
+		(a list of strings describing everything the result depends on); the errors are not
+		stored, so that the tests failing are executed again (a library may have been installed
+		meanwhile). The option --no-conf-cache disables the cache.
+		"""
+		h = Utils.h_list(key)
+		try:
+			val = self.check_cache[h]
+		except KeyError:
+			pass
+		else:
+			self.check_cache_new[h] = val
+			self.to_log('result of the previous configuration: %r' % (val,))
+			return val
+		ret = self.check_cache_new[h] = fun(*k, **kw)
+		return ret
+
+	def get_program_sig(self, lst):
+		"""
+		status of the programs (compilers) given as paths, names found in PATH, or lists of those
+		(nested lists such as [env.CC, env.AR]), for cache_check
+		"""
+		ret = []
+		todo = [lst]
+		while todo:
+			x = todo.pop(0)
+			if isinstance(x, (list, tuple)):
+				todo = list(x) + todo
+				continue
+			if not x:
+				continue
+			for name in Utils.to_list(x):
+				path = name
+				if not os.path.isabs(name) and not os.sep in name:
+					for d in self.environ.get('PATH', '').split(os.pathsep):
+						if d and os.path.isfile(os.path.join(d, name)):
+							path = os.path.join(d, name)
+							break
+				try:
+					st = os.stat(path)
+				except OSError:
+					ret.append(name)
+				else:
+					ret.append('%s %d %r' % (path, st.st_size, st.st_mtime))
+		return ' '.join(ret)
 
 	def check_tool(self, input, tooldir=None, funs=None, download=True):
 		"loads a waf tool"
@@ -20,12 +20,15 @@ WAFVERSION="1.6.0"
 WAFREVISION="8840M"
 """constant updated on new releases"""
 
-ABI = 98
+ABI = 100
 """project constant"""
 
 DBFILE = '.wafpickle-%d' % ABI
 """constant"""
 
+SQLITE_DBFILE = '.wafdb-%d.sqlite' % ABI
+"""build database in sqlite (see Build.sqlite_store)"""
+
 APPNAME = 'APPNAME'
 """constant"""
 
@@ -123,7 +126,7 @@ class Context(ctx):
 		self.node_class.__name__ = "Nod3"
 		self.node_class.ctx = self
 
-		self.root = waflib.Node.Nod3('', None)
+		self.root = node_class('', None)
 		self.cur_script = None
 		self.path = self.root.find_dir(start)
 
@@ -226,6 +229,11 @@ class Context(ctx):
 		kw['shell'] = isinstance(cmd, str)
 		Logs.debug('runner: %r' % cmd)
 
+		# let the make processes share the job slots of the build (see Runner.JobServer)
+		js = getattr(getattr(self, 'producer', None), 'jobserver', None)
+		if js:
+			js.update_kw(kw)
+
 		if Utils.is_win32 and isinstance(cmd, str) and len(cmd) > 2000:
 			# win32 stuff
 			startupinfo = subprocess.STARTUPINFO()
@@ -267,6 +275,11 @@ class Context(ctx):
 		kw['shell'] = isinstance(cmd, str)
 		Logs.debug('runner: %r' % cmd)
 
+		# let the make processes share the job slots of the build (see Runner.JobServer)
+		js = getattr(getattr(self, 'producer', None), 'jobserver', None)
+		if js:
+			js.update_kw(kw)
+
 		if Utils.is_win32 and isinstance(cmd, str) and len(cmd) > 2000:
 			# win32 stuff
 			startupinfo = subprocess.STARTUPINFO()
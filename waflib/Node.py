@@ -20,7 +20,9 @@ The BuildContext is referenced here as self.ctx
 Its Node class is referenced here as self.__class__
 """
 
-import os, shutil, re, sys
+import os, shutil, re, sys, time
+from array import array
+from bisect import bisect_left, bisect_right
 from waflib import Utils, Errors
 
 # These fnmatch expressions are used by default to prune the directory tree
@@ -60,6 +62,12 @@ exclude_regs = '''
 **/_darcs/**
 **/.DS_Store'''
 
+recent_delay = 2.0
+"""
+files modified less than recent_delay seconds before being hashed are hashed again on the next build:
+the timestamps of some filesystems are too coarse to notice a change made within the same second
+"""
+
 # TODO optimize split_path by performing a replacement when unpacking?
 
 def split_path(path):
@@ -92,6 +100,10 @@ class Node(object):
 	"""
 
 	__slots__ = ('name', 'sig', 'children', 'parent', 'cache_abspath', 'cache_isdir')
+
+	lazy_tree = None
+	"""nodes loaded from the build cache whose children are created on first access (see lazy_tree)"""
+
 	def __init__(self, name, parent):
 		self.name = name
 		self.parent = parent
@@ -620,16 +632,208 @@ class Node(object):
 			self.ctx.hash_cache = {}
 
 		if not self.is_bld():
-			self.sig = Utils.h_file(self.abspath())
+			self.sig = self.get_file_sig()
 		ret = self.sig
 		self.ctx.hash_cache[id(self)] = True
 		return ret
 
+	def get_file_sig(self):
+		"""
+		hash of the file contents; the hashes of the previous builds are re-used while the file
+		status (inode, size, modification and change times) does not change (BuildContext.file_sigs)
+		"""
+		path = self.abspath()
+		try:
+			cache = self.ctx.file_sigs
+		except AttributeError:
+			return Utils.h_file(path)
+
+		st = os.stat(path)
+		key = (st.st_ino, st.st_size, getattr(st, 'st_mtime_ns', st.st_mtime), getattr(st, 'st_ctime_ns', st.st_ctime))
+		try:
+			(k, sig) = cache[self]
+			if k == key:
+				return sig
+		except KeyError:
+			pass
+
+		sig = Utils.h_file(path)
+		if time.time() - max(st.st_mtime, st.st_ctime) > recent_delay:
+			cache[self] = (key, sig)
+		else:
+			cache.pop(self, None)
+		return sig
+
 
 
 pickle_lock = Utils.threading.Lock()
 """thread-safe node serialization requires this"""
 
+def flatten(root):
+	"""
+	compact representation of a tree of nodes for the build cache (see lazy_tree), instead of
+	nested tuples and dicts (see Node.__getstate__):
+
+	* the names joined by '/' (the node names cannot contain it, see split_path)
+	* an array of parent indices, the children of a node are consecutive and listed after it
+	* an array of flags, 1 if the children of the node are known
+	* the signatures concatenated, and an array of their end positions
+
+	the folders loaded from the previous build cache but never accessed are copied as they are
+
+	return the data and a dict mapping the ids of the nodes to their indices
+	"""
+	tree = root.lazy_tree
+	names = []
+	parents = array('i')
+	dirs = array('b')
+	sigs = []
+	ends = array('I')
+	index = {}
+	pos = [0]
+
+	def add(node, parent):
+		index[id(node)] = len(names)
+		names.append(node.name)
+		parents.append(parent)
+		if tree and tree.is_pending(node):
+			dirs.append(1)
+		else:
+			dirs.append(hasattr(node, 'children') and 1 or 0)
+		sig = getattr(node, 'sig', None)
+		if sig:
+			sigs.append(sig)
+			pos[0] += len(sig)
+		ends.append(pos[0])
+
+	# the elements are either nodes or the indices of nodes in the lazy tree
+	queue = [root]
+	add(root, -1)
+	for (i, node) in enumerate(queue):
+		if isinstance(node, int):
+			if not tree.dirs[node]:
+				continue
+			k = node
+		elif tree and tree.is_pending(node):
+			k = tree.pending[id(node)]
+		else:
+			try:
+				children = node.children
+			except AttributeError:
+				continue
+			for x in children.values():
+				queue.append(x)
+				add(x, i)
+			continue
+
+		# the children are consecutive, and so are their signatures
+		(lo, hi) = tree.get_range(k)
+		if lo == hi:
+			continue
+		queue.extend(range(lo, hi))
+		names.extend(tree.names[lo:hi])
+		parents.extend(array('i', [i]) * (hi - lo))
+		dirs.extend(tree.dirs[lo:hi])
+		start = tree.ends[lo - 1]
+		delta = pos[0] - start
+		ends.extend(array('I', [x + delta for x in tree.ends[lo:hi]]))
+		sigs.append(tree.sigs[start:tree.ends[hi - 1]])
+		pos[0] = ends[-1]
+
+	return (('/'.join(names), parents, dirs, b''.join(sigs), ends), index)
+
+class lazy_tree(object):
+	"""
+	nodes created from the data returned by flatten: the children of a folder are created
+	when the attribute 'children' is accessed, so that the folders which are not used by a
+	build are not loaded in memory; until then the folder is an instance of a subclass
+	of the node class (lazy_class), so that the other nodes do not pay for __getattr__
+	"""
+	def __init__(self, data, node_class):
+		(names, self.parents, self.dirs, self.sigs, self.ends) = data
+		self.names = names.split('/')
+		self.nodes = [None] * len(self.names)
+		self.node_class = node_class
+		self.lock = Utils.threading.Lock()
+
+		tree = self
+		class lazy_class(node_class):
+			__slots__ = ()
+			def __getattr__(self, name):
+				if name == 'children' and id(self) in tree.pending:
+					return tree.load_children(self)
+				raise AttributeError(name)
+		self.lazy_class = lazy_class
+
+		self.pending = {}
+		"""ids of the folder nodes -> indices, for the folders whose children are not created yet"""
+
+		self.root = self.create(0, None)
+
+	def get_range(self, i):
+		"indices of the children of the node i"
+		lo = bisect_left(self.parents, i, 1)
+		return (lo, bisect_right(self.parents, i, lo))
+
+	def is_pending(self, node):
+		"True if the children of the node were not created yet"
+		if not id(node) in self.pending:
+			return False
+		try:
+			# the attribute may have been set directly (BuildContext.clean)
+			object.__getattribute__(node, 'children')
+		except AttributeError:
+			return True
+		del self.pending[id(node)]
+		node.__class__ = self.node_class
+		return False
+
+	def get_sig(self, i):
+		start = i and self.ends[i - 1] or 0
+		return self.sigs[start:self.ends[i]]
+
+	def create(self, i, parent):
+		if self.dirs[i]:
+			cls = self.lazy_class
+		else:
+			cls = self.node_class
+		node = cls.__new__(cls)
+		node.name = self.names[i]
+		node.parent = parent
+		sig = self.get_sig(i)
+		if sig:
+			node.sig = sig
+		if self.dirs[i]:
+			self.pending[id(node)] = i
+		self.nodes[i] = node
+		return node
+
+	def load_children(self, node):
+		"create the children of a folder"
+		self.lock.acquire()
+		try:
+			try:
+				i = self.pending.pop(id(node))
+			except KeyError:
+				return node.children
+			children = {}
+			(lo, hi) = self.get_range(i)
+			for k in range(lo, hi):
+				children[self.names[k]] = self.create(k, node)
+			node.children = children
+			node.__class__ = self.node_class
+			return children
+		finally:
+			self.lock.release()
+
+	def get_node(self, i):
+		"node of index i, the parent folders are loaded if necessary (persistent_load in the build cache)"
+		node = self.nodes[i]
+		if node is None:
+			self.get_node(self.parents[i]).children
+			node = self.nodes[i]
+		return node
+
 class Nod3(Node):
 	pass
 
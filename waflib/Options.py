@@ -30,7 +30,7 @@ class opt_parser(optparse.OptionParser):
 		self.ctx = ctx
 
 		jobs = ctx.jobs()
-		p('-j', '--jobs',     dest='jobs',    default=jobs, type='int', help='amount of parallel jobs (%r)' % ctx)
+		p('-j', '--jobs',     dest='jobs',    default=jobs, action='store', help='amount of parallel jobs (%r), or auto[:min[:max]] to follow the system load' % ctx)
 		p('-k', '--keep',     dest='keep',    default=False, action='store_true', help='keep running happily on independent task groups')
 		p('-v', '--verbose',  dest='verbose', default=0,     action='count', help='verbosity level -v -vv or -vvv [default: 0]')
 		p('--nocache',        dest='nocache', default=False, action='store_true', help='ignore the WAFCACHE (if set)')
@@ -52,6 +52,7 @@ class opt_parser(optparse.OptionParser):
 				default_prefix = '/usr/local/'
 		gr.add_option('--prefix', dest='prefix', default=default_prefix, help='installation prefix [default: %r]' % default_prefix)
 		gr.add_option('--download', dest='download', default=False, action='store_true', help='try to download the tools if missing')
+		gr.add_option('--no-conf-cache', dest='no_conf_cache', default=False, action='store_true', help='run all the configuration tests again instead of re-using the results of the previous configuration')
 
 
 		gr = optparse.OptionGroup(self, 'build and install options')
@@ -59,6 +60,12 @@ class opt_parser(optparse.OptionParser):
 
 		gr.add_option('-p', '--progress', dest='progress_bar', default=0, action='count', help= '-p: progress bar; -pp: ide output')
 		gr.add_option('--targets',        dest='targets', default='', action='store', help='task generators, e.g. "target1,target2"')
+		gr.add_option('--critical-path',  dest='critical_path', default=False, action='store_true', help='execute the tasks on the longest paths first (durations from the previous builds)')
+		gr.add_option('--pipeline',       dest='pipeline', default=False, action='store_true', help='start the tasks of the next groups before the current group is complete (implies --depcount)')
+		gr.add_option('--procs',          dest='procs', default=0, type='int', help='execute the python tasks in worker processes (amount of processes)')
+		gr.add_option('--budget',         dest='budget', default=0, type='int', help='resources available to the running tasks (Task.cost), 0 for no limit')
+		gr.add_option('--jobserver',      dest='jobserver', default=False, action='store_true', help='share the job slots with the make processes started by the build (GNU make jobserver)')
+		gr.add_option('--depcount',       dest='depcount', default=False, action='store_true', help='release the tasks when their predecessors are complete instead of polling them')
 
 		gr = optparse.OptionGroup(self, 'step options')
 		self.add_option_group(gr)
@@ -171,9 +178,36 @@ class OptionsContext(Context.Context):
 		(options, leftover_args) = self.parser.parse_args(args=_args)
 		commands = leftover_args
 
+		self.parse_jobs(options)
+
 		if options.destdir:
 			options.destdir = os.path.abspath(os.path.expanduser(options.destdir))
 
+	def parse_jobs(self, options):
+		"""
+		Process the -j value: a positive integer, or auto[:min[:max]] to let the
+		build adapt the amount of jobs (options.auto_jobs is then set to (min, max))
+		"""
+		options.auto_jobs = None
+		val = str(options.jobs)
+		try:
+			if val.startswith('auto'):
+				lst = val.split(':')
+				if lst[0] != 'auto' or len(lst) > 3:
+					raise ValueError(val)
+				mini = len(lst) > 1 and lst[1] and int(lst[1]) or 1
+				maxi = len(lst) > 2 and lst[2] and int(lst[2]) or max(self.jobs(), mini)
+				if mini < 1 or maxi < mini:
+					raise ValueError(val)
+				options.auto_jobs = (mini, maxi)
+				options.jobs = maxi
+			else:
+				options.jobs = int(val)
+				if options.jobs < 1:
+					raise ValueError(val)
+		except ValueError:
+			self.parser.error('invalid value for -j: %r (expected a positive integer or auto[:min[:max]])' % val)
+
 	def execute(self):
 		super(OptionsContext, self).execute()
 		self.parse_args()
@@ -4,16 +4,27 @@
 
 "Execute the tasks"
 
-import os, sys, random
+import os, sys, random, time, errno, select
 try:
 	from queue import Queue
 except:
 	from Queue import Queue
-from waflib import Utils, Logs, Options, Task, Errors
+from waflib import Utils, Logs, Options, Task, Errors, ConfigSet
+try:
+	import multiprocessing
+except ImportError:
+	multiprocessing = None
+try:
+	import cPickle
+except ImportError:
+	import pickle as cPickle
 
 GAP = 15
 MAXJOBS = 999
 
+AUTO_INTERVAL = 1.0 # seconds between two adjustments of the amount of jobs (-j auto)
+AUTO_MEMORY = 0.1 # fraction of the physical memory to keep available (-j auto)
+
 class TaskConsumer(Utils.threading.Thread):
 	ready = Queue(0)
 	pool = []
@@ -32,6 +43,10 @@ class TaskConsumer(Utils.threading.Thread):
 	def loop(self):
 		while 1:
 			tsk = TaskConsumer.ready.get()
+			js = tsk.master.jobserver
+			if js:
+				# the token is given back by the producer (Parallel.get_out)
+				tsk.token = js.acquire()
 			process_task(tsk)
 
 def process_task(tsk):
@@ -42,9 +57,13 @@ def process_task(tsk):
 
 	try:
 		tsk.generator.bld.to_log(tsk.display())
+		t = time.time()
 		if tsk.__class__.stat: ret = tsk.__class__.stat(tsk)
+		# python tasks may be executed in worker processes
+		elif m.procpool and getattr(tsk, 'process_safe', False) and not tsk.__class__ in m.no_procs: ret = m.run_process(tsk)
 		# actual call to task's run() function
 		else: ret = tsk.call_run()
+		tsk.duration = time.time() - t
 	except Exception as e:
 		tsk.err_msg = Utils.ex_stack()
 		tsk.hasrun = Task.EXCEPTION
@@ -72,6 +91,264 @@ def process_task(tsk):
 
 	m.out.put(tsk)
 
+class proc_node(object):
+	"""
+	stand-in for the nodes of the tasks executed in worker processes (see get_task_state),
+	only the name, the absolute path and the methods read/write are available
+	"""
+	def __init__(self, node):
+		self.name = node.name
+		self.path = node.abspath()
+
+	def __str__(self):
+		return self.name
+
+	def __repr__(self):
+		return self.path
+
+	def abspath(self):
+		return self.path
+
+	def read(self, flags='r'):
+		return Utils.readf(self.path, flags)
+
+	def write(self, data, flags='w'):
+		f = open(self.path, flags)
+		try:
+			f.write(data)
+		finally:
+			f.close()
+
+def get_task_state(tsk):
+	"""
+	the data sent to a worker process: the task class name and module, and the inputs,
+	outputs, env (snapshot) and attributes listed in process_vars
+	"""
+	state = {
+		'inputs': [proc_node(x) for x in tsk.inputs],
+		'outputs': [proc_node(x) for x in tsk.outputs],
+		'env': tsk.env.get_merged_dict(),
+	}
+	for x in tsk.process_vars:
+		try:
+			state[x] = getattr(tsk, x)
+		except AttributeError:
+			pass
+	return (tsk.__class__.__name__.replace('_task', ''), tsk.__class__.__module__, state)
+
+def run_task_state(data):
+	"""
+	executed in the worker processes: re-create the task from the pickled data (see get_task_state)
+	and call its run method (the parent calls call_run, see Parallel.run_process)
+	return (ret, err, process_vars values), or None if the task class is unknown
+	"""
+	(name, module, state) = cPickle.loads(data)
+	if not name in Task.classes:
+		# the workers may not have loaded the module (see make_pool)
+		try:
+			__import__(module)
+		except ImportError:
+			pass
+	try:
+		cls = Task.classes[name]
+	except KeyError:
+		# created after the worker processes, or in a wscript file
+		return None
+
+	tsk = cls.__new__(cls)
+	env = ConfigSet.ConfigSet()
+	env.table = state.pop('env')
+	tsk.__dict__.update(state)
+	tsk.env = env
+	tsk.generator = None
+	try:
+		ret = tsk.run()
+	except Exception:
+		return (None, Utils.ex_stack(), {})
+
+	upd = {}
+	for x in cls.process_vars:
+		try:
+			upd[x] = getattr(tsk, x)
+		except AttributeError:
+			pass
+	return (ret, None, upd)
+
+def make_pool(procs):
+	"""
+	worker processes for run_task_state, or None if they cannot be created safely: forking is only
+	done if no other thread is running (the locks held by other threads would remain locked in the
+	children), else a new interpreter is started (forkserver or spawn), which only knows the task
+	classes of the modules it can import
+	"""
+	if Utils.threading.active_count() == 1:
+		return multiprocessing.Pool(procs)
+	try:
+		methods = multiprocessing.get_all_start_methods()
+	except AttributeError:
+		return None
+	for x in ('forkserver', 'spawn'):
+		if x in methods:
+			return multiprocessing.get_context(x).Pool(procs)
+	return None
+
+def get_free_memory():
+	"fraction of the physical memory available, or None if unknown (/proc/meminfo)"
+	vals = {}
+	try:
+		for line in Utils.readf('/proc/meminfo').splitlines():
+			lst = line.split()
+			vals[lst[0].rstrip(':')] = int(lst[1])
+	except (IOError, OSError, IndexError, ValueError):
+		return None
+	try:
+		free = vals.get('MemAvailable', vals['MemFree'] + vals.get('Buffers', 0) + vals.get('Cached', 0))
+		return float(free) / vals['MemTotal']
+	except (KeyError, ZeroDivisionError):
+		return None
+
+def get_cpus():
+	"amount of processors, or None if unknown"
+	try:
+		return multiprocessing.cpu_count()
+	except (AttributeError, NotImplementedError):
+		return None
+
+def parse_makeflags(flags):
+	"""
+	return the file descriptors (read, write, opened) of the jobserver given in MAKEFLAGS,
+	or None if there is no jobserver or if the descriptors were not inherited
+	opened is True if the descriptor was opened by this process (named pipe)
+	"""
+	ret = None
+	for x in flags.split():
+		for opt in ('--jobserver-auth=', '--jobserver-fds='):
+			if x.startswith(opt):
+				ret = x[len(opt):]
+	if not ret:
+		return None
+
+	try:
+		if ret.startswith('fifo:'):
+			fd = os.open(ret[5:], os.O_RDWR)
+			return (fd, fd, True)
+		(r, w) = [int(x) for x in ret.split(',')]
+		os.fstat(r)
+		os.fstat(w)
+	except (OSError, ValueError):
+		Logs.warn('the jobserver given in MAKEFLAGS is unavailable (use "+" in the make rule?)')
+		return None
+	return (r, w, False)
+
+class JobServer(object):
+	"""
+	share the job slots with make through a pipe of tokens (GNU make jobserver protocol)
+	each process owns an implicit token, and reads a byte from the pipe to run another job
+	"""
+	def __init__(self, rfd, wfd, makeflags, server=False, opened=False):
+		self.rfd = rfd
+		self.wfd = wfd
+		self.makeflags = makeflags # MAKEFLAGS for the child processes
+		self.server = server # the pipe was created by this process
+		self.opened = opened # the named pipe of the parent make was opened by this process
+		self.implicit = True
+		self.lock = Utils.threading.Lock()
+
+	def acquire(self):
+		"""
+		wait for a token (called from the consumer threads), return None for the implicit token,
+		or the byte to write back once the task is complete
+		"""
+		while 1:
+			self.lock.acquire()
+			try:
+				if self.implicit:
+					self.implicit = False
+					return None
+			finally:
+				self.lock.release()
+
+			# check the implicit token again from time to time
+			try:
+				if not select.select([self.rfd], [], [], 0.1)[0]:
+					continue
+				tok = os.read(self.rfd, 1)
+			except (OSError, select.error) as e:
+				if e.args[0] in (errno.EINTR, errno.EAGAIN):
+					continue
+				raise
+			if not tok:
+				raise Errors.WafError('the jobserver pipe was closed')
+			return tok
+
+	def release(self, tok):
+		"give a token back"
+		if tok is None:
+			self.lock.acquire()
+			self.implicit = True
+			self.lock.release()
+		else:
+			os.write(self.wfd, tok)
+
+	def update_kw(self, kw):
+		"give the jobserver to a child process: MAKEFLAGS and file descriptors (see Context.exec_command)"
+		env = dict(kw.get('env') or os.environ)
+		env['MAKEFLAGS'] = self.makeflags
+		kw['env'] = env
+		if sys.hexversion >= 0x3020000 and not self.opened:
+			kw['pass_fds'] = tuple(set(kw.get('pass_fds', ())) | set([self.rfd, self.wfd]))
+
+	def close(self):
+		"close the pipe if it was created or opened by this process"
+		if self.server:
+			os.close(self.rfd)
+			os.close(self.wfd)
+		elif self.opened:
+			os.close(self.rfd)
+
+def get_jobserver(numjobs):
+	"""
+	use the jobserver of a parent make process if any (MAKEFLAGS), else create one if
+	waf build --jobserver was given, return None otherwise
+	"""
+	if Utils.is_win32 or numjobs < 2:
+		return None
+
+	flags = os.environ.get('MAKEFLAGS', '')
+	fds = parse_makeflags(flags)
+	if fds:
+		Logs.debug('runner: using the jobserver from MAKEFLAGS %r' % flags)
+		return JobServer(fds[0], fds[1], flags, opened=fds[2])
+
+	if getattr(Options.options, 'jobserver', False):
+		(r, w) = os.pipe()
+		os.write(w, b'+' * (numjobs - 1))
+		flags = '%s -j%d --jobserver-fds=%d,%d --jobserver-auth=%d,%d' % (flags, numjobs, r, w, r, w)
+		return JobServer(r, w, flags.strip(), server=True)
+	return None
+
+def get_cost(tsk):
+	"""
+	resources used by a task: the attribute 'cost' of the task generator (a number,
+	or a dict mapping task class names to numbers) else the attribute of the task class
+	"""
+	cost = getattr(tsk.generator, 'cost', None)
+	if isinstance(cost, dict):
+		cost = cost.get(tsk.__class__.__name__, None)
+	if cost is None:
+		cost = tsk.cost
+	return cost
+
+def get_concurrency_class(cls, cache={}):
+	"the class defining the attribute 'concurrency' (the limit is shared by the subclasses)"
+	try:
+		return cache[cls]
+	except KeyError:
+		for x in cls.__mro__:
+			if 'concurrency' in x.__dict__:
+				cache[cls] = x
+				return x
+
 class Parallel(object):
 	"""
 	keep the consumer threads busy, and avoid consuming cpu cycles
@@ -104,45 +381,441 @@ class Parallel(object):
 		self.error = [] # tasks in error
 		self.biter = None # build iterator, must give groups of parallelizable tasks on next()
 
+		# run the tasks on the longest paths first (see compute_priorities)
+		self.critical = getattr(Options.options, 'critical_path', False)
+		self.priority = {}
+		self.dirty = False # the outstanding tasks must be sorted again
+
+		# release the tasks when their predecessors are complete instead of asking them (see register)
+		self.depcount = getattr(Options.options, 'depcount', False)
+		self.waiting = {} # tasks -> amount of predecessors not run yet
+		self.revdeps = Utils.defaultdict(list) # tasks -> tasks waiting for them
+
+		# post the next groups without waiting for the current one to complete (see set_group_constraints)
+		self.pipeline = getattr(Options.options, 'pipeline', False)
+		if self.pipeline:
+			from waflib import Build
+			if getattr(bld, 'post_mode', None) == Build.POST_LAZY:
+				# the task generators may depend on the files created by the previous groups
+				self.pipeline = False
+			else:
+				self.depcount = True
+		self.pending = [] # tasks of the previous groups (pipeline)
+		self.more = True # the build iterator may still return tasks
+
+		# map the output nodes to the tasks creating them (id(node) -> task), see inst_task
+		self.producers = {}
+
+		# worker processes for the python tasks that hold the gil (see Task.process_safe)
+		self.procs = getattr(Options.options, 'procs', 0)
+		if not multiprocessing or Utils.is_win32:
+			self.procs = 0
+		self.procpool = None
+		self.no_procs = set([]) # task classes which cannot be run in the worker processes
+
+		# tasks of the build (see Build.BuildContext.prune_data)
+		self.loaded = []
+
+		# resources available to the running tasks (see take_resources)
+		self.budget = getattr(Options.options, 'budget', 0)
+		self.used = 0 # resources used by the running tasks
+		self.running = Utils.defaultdict(int) # class defining the concurrency -> tasks running
+		self.acquired = {} # running task -> (cost, class defining the concurrency)
+		self.held = [] # runnable tasks waiting for resources
+		self.held_stats = Utils.defaultdict(lambda: [0, 0.0]) # task class name -> [tasks held, seconds]
+
+		# share the job slots with the make processes (see JobServer)
+		self.jobserver = get_jobserver(self.numjobs)
+
+		# follow the system load and the available memory, the consumer threads
+		# are created for the maximum amount of jobs (see adjust_jobs)
+		self.auto = getattr(Options.options, 'auto_jobs', None)
+		self.limit = self.numjobs
+		self.last = 0
+		self.cpus = get_cpus() or self.numjobs
+		if self.auto:
+			try:
+				load = os.getloadavg()[0]
+			except (AttributeError, OSError):
+				load = 0
+			(mini, maxi) = self.auto
+			self.limit = max(mini, min(maxi, int(self.cpus - load)))
+			Logs.debug('runner: -j auto, %d jobs to start with (min %d, max %d, load %.2f, %d cpus)' % (self.limit, mini, maxi, load, self.cpus))
+
 	def get_next_task(self):
 		"override this method to schedule the tasks in a particular order"
 		if not self.outstanding:
 			return None
+		if self.dirty:
+			self.dirty = False
+			prio = self.priority
+			self.outstanding.sort(key=lambda t: prio.get(t, 0), reverse=True)
 		return self.outstanding.pop(0)
 
+	def add_outstanding(self, tasks):
+		"add tasks to the list of tasks to consider, the order is enforced by get_next_task"
+		self.outstanding.extend(tasks)
+		if self.priority:
+			self.dirty = True
+
 	def postpone(self, tsk):
 		"override this method to schedule the tasks in a particular order"
+		if self.critical:
+			# keep the order, the outstanding tasks are sorted again anyway
+			self.frozen.append(tsk)
 		# TODO consider using a deque instead
-		if random.randint(0, 1):
+		elif random.randint(0, 1):
 			self.frozen.insert(0, tsk)
 		else:
 			self.frozen.append(tsk)
 
+	def register(self, tsk):
+		"""
+		count the predecessors of a task that have not run yet, and make the task wait for them
+		return True if the task must wait (dependency counting mode, see release)
+		"""
+		cnt = 0
+		for t in getattr(tsk, 'run_after', ()):
+			if not t.hasrun:
+				self.revdeps[t].append(tsk)
+				cnt += 1
+		if cnt:
+			self.waiting[tsk] = cnt
+		return cnt > 0
+
+	def release(self, tsk):
+		"""
+		a task is complete (run, skipped or failed): decrement the counters of the tasks
+		waiting for it, and move the ones that have no more predecessors to the outstanding tasks
+		"""
+		try:
+			lst = self.revdeps.pop(tsk)
+		except KeyError:
+			return
+		ready = []
+		for t in lst:
+			self.waiting[t] -= 1
+			if not self.waiting[t]:
+				del self.waiting[t]
+				ready.append(t)
+		if ready:
+			self.add_outstanding(ready)
+
+	def check_deadlock(self):
+		"nothing is running and nothing is ready: the tasks still waiting can never run"
+		if self.waiting and not self.stop:
+			lst = [repr(t).strip() for t in list(self.waiting.keys())[:10]]
+			raise Errors.WafError('Deadlock detected: tasks waiting for tasks which are never run:\n%s' % '\n'.join(lst))
+
+	def compute_priorities(self, tasks):
+		"""
+		estimate the length of the longest path from each task to the end of the group,
+		using the durations recorded in previous builds (bld.task_times) and the run_after
+		constraints; the tasks are then executed by decreasing priorities (see get_next_task)
+
+		nothing is done if no duration is known (first build), the default order is kept
+		"""
+		times = self.bld.task_times
+		dur = {}
+		for t in tasks:
+			# the uid is computed once, not before the inputs are known (see Build.sqlite_store.prefetch)
+			if not getattr(t, 'inputs', None):
+				continue
+			try:
+				dur[t] = times[t.uid()]
+			except KeyError:
+				pass
+		if not dur:
+			return
+		# unknown tasks are assumed to last as long as the average task
+		avg = sum(dur.values()) / len(dur)
+
+		# successors within the group
+		succ = Utils.defaultdict(list)
+		group = set(tasks)
+		for t in tasks:
+			for p in getattr(t, 'run_after', ()):
+				if p in group:
+					succ[p].append(t)
+
+		# visit the tasks from the end of the graph (no successors) to the start
+		left = {}
+		todo = []
+		for t in tasks:
+			left[t] = len(succ[t])
+			if not left[t]:
+				todo.append(t)
+
+		prio = self.priority
+		while todo:
+			t = todo.pop()
+			prio[t] = dur.get(t, avg) + max([prio[s] for s in succ[t]] or [0])
+			for p in getattr(t, 'run_after', ()):
+				if p in group:
+					left[p] -= 1
+					if not left[p]:
+						todo.append(p)
+
+		# tasks in a cycle (should not happen): use their own duration
+		for t in tasks:
+			if not t in prio:
+				prio[t] = dur.get(t, avg)
+
+	def set_group_constraints(self, tasks):
+		"""
+		pipeline mode: make the tasks of a new group wait for the tasks of the previous groups
+		that are not complete yet, if they use their outputs (inputs, dep_nodes or implicit
+		dependencies from the previous build) or if the task classes are ordered (ext_in/ext_out, before/after);
+		the tasks having a scanner that did not run yet (first build) wait for all of them, as
+		the group order is the only way of knowing about the headers created by previous groups
+		"""
+		self.pending = [t for t in self.pending if not t.hasrun]
+
+		outs = Utils.defaultdict(list)
+		cstr = Utils.defaultdict(list)
+		for t in self.pending:
+			for a in getattr(t, 'outputs', []):
+				outs[id(a)].append(t)
+			cstr[t.hash_constraints()].append(t)
+
+		if self.pending:
+			deps = self.bld.node_deps
+			for t in tasks:
+				try:
+					lst = t.inputs + getattr(t, 'dep_nodes', [])
+				except AttributeError:
+					# plain TaskBase instances
+					continue
+				# the uid is computed once, not before the inputs are known (see Build.sqlite_store.prefetch)
+				uid = t.inputs and t.uid()
+				if t.scan and not (uid and uid in deps):
+					t.run_after.update(self.pending)
+					continue
+				if uid:
+					lst += deps.get(uid, [])
+				for a in lst:
+					if id(a) in outs:
+						t.run_after.update(outs[id(a)])
+
+			new_cstr = Utils.defaultdict(list)
+			for t in tasks:
+				new_cstr[t.hash_constraints()].append(t)
+			for lst in new_cstr.values():
+				t1 = lst[0]
+				for prev in cstr.values():
+					t2 = prev[0]
+					if Task.compare_exts(t1, t2) or Task.compare_partial(t1, t2):
+						for t in lst:
+							t.run_after.update(prev)
+
+		self.pending.extend(tasks)
+
+	def load_group(self):
+		"obtain the next group of tasks from the build iterator"
+		tasks = next(self.biter)
+		if not tasks:
+			self.more = False
+		self.loaded.extend(tasks)
+
+		if self.pipeline:
+			self.set_group_constraints(tasks)
+		for t in tasks:
+			for a in getattr(t, 'outputs', []):
+				self.producers[id(a)] = t
+		if self.critical:
+			self.compute_priorities(tasks)
+		if self.depcount:
+			tasks = [t for t in tasks if not self.register(t)]
+		self.add_outstanding(tasks)
+		self.total = self.bld.total()
+
+	def take_resources(self, tsk):
+		"""
+		reserve the resources of a task, or return False if running it would exceed
+		the budget (--budget) or the concurrency limit of its class (Task.concurrency)
+		a task is always accepted when no other task is running
+		"""
+		cost = get_cost(tsk)
+		key = get_concurrency_class(tsk.__class__)
+		if self.acquired:
+			if self.budget and cost and self.used + cost > self.budget:
+				return False
+			if key.concurrency and self.running[key] >= key.concurrency:
+				return False
+		self.used += cost
+		self.running[key] += 1
+		self.acquired[tsk] = (cost, key)
+		return True
+
+	def free_resources(self, tsk):
+		"give back the resources of a task that is complete"
+		try:
+			(cost, key) = self.acquired.pop(tsk)
+		except KeyError:
+			return
+		self.used -= cost
+		self.running[key] -= 1
+
+	def hold(self, tsk):
+		"keep a runnable task until enough resources are available (see start_held)"
+		tsk.budget_wait = time.time()
+		self.held_stats[tsk.__class__.__name__][0] += 1
+		self.held.append(tsk)
+
+	def start_held(self):
+		"run the held tasks that fit in the resources now (in the original order)"
+		lst = self.held
+		self.held = []
+		for tsk in lst:
+			if not self.stop and self.take_resources(tsk):
+				tsk.budget_wait = time.time() - tsk.budget_wait
+				self.held_stats[tsk.__class__.__name__][1] += tsk.budget_wait
+				self.dispatch(tsk)
+			else:
+				self.held.append(tsk)
+
+	def dispatch(self, tsk):
+		"give a task to the consumer threads"
+		tsk.position = (self.processed, self.total)
+		self.count += 1
+		tsk.master = self
+		self.processed += 1
+
+		if self.numjobs == 1:
+			process_task(tsk)
+		else:
+			TaskConsumer.ready.put(tsk)
+			# create the consumer threads only if there is something to consume
+			if not TaskConsumer.pool:
+				TaskConsumer.pool = [TaskConsumer() for i in range(self.numjobs)]
+
+	def adjust_jobs(self):
+		"""
+		-j auto: change the amount of tasks in flight by one, at most once per AUTO_INTERVAL
+		shrink when the load exceeds the processors or when the memory is low,
+		grow when at least one processor is idle and the memory is sufficient
+		"""
+		now = time.time()
+		if now - self.last < AUTO_INTERVAL:
+			return
+		self.last = now
+
+		try:
+			load = os.getloadavg()[0]
+		except (AttributeError, OSError):
+			load = None
+		mem = get_free_memory()
+
+		limit = self.limit
+		if mem is not None and mem < AUTO_MEMORY:
+			limit -= 1
+		elif load is not None and load > self.cpus:
+			limit -= 1
+		elif load is not None and load < self.cpus - 1 and (mem is None or mem > 2 * AUTO_MEMORY):
+			limit += 1
+
+		(mini, maxi) = self.auto
+		limit = max(mini, min(maxi, limit))
+		if limit != self.limit:
+			Logs.debug('runner: -j auto, %d -> %d jobs (load %s, free memory %s, %d running)' % (
+				self.limit, limit,
+				load is None and '?' or '%.2f' % load,
+				mem is None and '?' or '%d%%' % (100 * mem),
+				self.count))
+			self.limit = limit
+
 	def refill_task_list(self):
 		"called to set the next group of tasks"
 
-		while self.count > self.numjobs + GAP or self.count >= self.maxjobs:
+		if self.auto:
+			self.adjust_jobs()
+
+		while self.count > self.numjobs + GAP or self.count >= self.maxjobs or (self.auto and self.count >= self.limit):
 			self.get_out()
 
 		while not self.outstanding:
+			if self.pipeline and self.more:
+				# no need to wait for the running tasks
+				self.load_group()
+				continue
+
 			if self.count:
 				self.get_out()
 
 			if self.frozen:
-				self.outstanding += self.frozen
+				self.add_outstanding(self.frozen)
 				self.frozen = []
-			elif not self.count:
-				self.outstanding.extend(next(self.biter))
-				self.total = self.bld.total()
+			elif not self.count and not self.outstanding:
+				self.check_deadlock()
+				self.load_group()
 				break
 
 	def get_out(self):
 		"the tasks that are put to execute are all collected using get_out"
 		ret = self.out.get()
 		if not self.stop and getattr(ret, 'more_tasks', None):
-			self.outstanding += ret.more_tasks
+			for t in ret.more_tasks:
+				for a in getattr(t, 'outputs', []):
+					self.producers[id(a)] = t
+			if getattr(self.bld, 'store', None):
+				self.bld.store.prefetch(ret.more_tasks)
+			self.add_outstanding(ret.more_tasks)
+			self.loaded.extend(ret.more_tasks)
 			self.total += len(ret.more_tasks)
 		self.count -= 1
+		if self.depcount:
+			self.release(ret)
+		if self.jobserver:
+			self.jobserver.release(getattr(ret, 'token', None))
+			ret.token = None
+		self.free_resources(ret)
+		if self.held:
+			self.start_held()
+
+		# remember how long the task lasted for the next builds (see compute_priorities)
+		if ret.hasrun == Task.SUCCESS:
+			try:
+				self.bld.task_times[ret.uid()] = ret.duration
+			except AttributeError:
+				pass
+
+	def run_process(self, tsk):
+		"""
+		execute a task in a worker process (called from the consumer threads): call_run is used
+		as in the threads, only the method run is replaced by the execution in the worker; the
+		task is run in the current thread if its data cannot be sent or if the workers do not
+		know its class, and the other tasks of the class are not sent anymore (no_procs)
+		"""
+		cls = tsk.__class__
+		local = tsk.__dict__.get('run', None)
+		run_here = tsk.run
+
+		def run():
+			try:
+				ret = self.procpool.apply(run_task_state, (cPickle.dumps(get_task_state(tsk), -1),))
+			except Exception as e:
+				ret = e
+			if ret is None or isinstance(ret, Exception):
+				if not cls in self.no_procs:
+					self.no_procs.add(cls)
+					Logs.debug('runner: the tasks %s are not run in processes (%r)' % (cls.__name__, ret))
+				return run_here()
+
+			(ret, err, upd) = ret
+			for (k, v) in upd.items():
+				setattr(tsk, k, v)
+			if err:
+				raise Errors.WafError('exception in a worker process\n%s' % err)
+			return ret
+
+		tsk.run = run
+		try:
+			return tsk.call_run()
+		finally:
+			if local is None:
+				del tsk.run
+			else:
+				tsk.run = local
 
 	def error_handler(self, tsk):
 		"by default, errors make the build stop (not thread safe so be careful)"
@@ -153,6 +826,12 @@ class Parallel(object):
 	def start(self):
 		"execute the tasks"
 
+		if self.procs:
+			# post the first group so that the task classes exist in the worker processes,
+			# and fork before the consumer threads of this build are created
+			self.refill_task_list()
+			self.procpool = make_pool(self.procs)
+
 		if TaskConsumer.pool:
 			# the worker pool is usually loaded lazily (see below)
 			# in case it is re-used with a different value of numjobs:
@@ -171,17 +850,22 @@ class Parallel(object):
 					continue
 				else:
 					# no tasks to run, no tasks running, time to exit
+					self.check_deadlock()
 					break
 
 			if tsk.hasrun:
 				# if the task is marked as "run", just skip it
 				self.processed += 1
+				if self.depcount:
+					self.release(tsk)
 				continue
 
 			try:
 				st = tsk.runnable_status()
 			except Exception as e:
 				self.processed += 1
+				if self.depcount:
+					self.release(tsk)
 				if self.stop and not Options.options.keep:
 					tsk.hasrun = Task.SKIPPED
 					continue
@@ -191,24 +875,20 @@ class Parallel(object):
 				continue
 
 			if st == Task.ASK_LATER:
-				self.postpone(tsk)
+				# the task may have been given new predecessors (inst_task)
+				if not (self.depcount and self.register(tsk)):
+					self.postpone(tsk)
 			elif st == Task.SKIP_ME:
 				self.processed += 1
 				tsk.hasrun = Task.SKIPPED
+				if self.depcount:
+					self.release(tsk)
+			elif self.numjobs > 1 and not self.take_resources(tsk):
+				# not enough resources, the task is started when another one completes (see get_out)
+				self.hold(tsk)
 			else:
 				# run me: put the task in ready queue
-				tsk.position = (self.processed, self.total)
-				self.count += 1
-				tsk.master = self
-				self.processed += 1
-
-				if self.numjobs == 1:
-					process_task(tsk)
-				else:
-					TaskConsumer.ready.put(tsk)
-					# create the consumer threads only if there is something to consume
-					if not TaskConsumer.pool:
-						TaskConsumer.pool = [TaskConsumer() for i in range(self.numjobs)]
+				self.dispatch(tsk)
 
 
 		# self.count represents the tasks that have been made available to the consumer threads
@@ -219,3 +899,15 @@ class Parallel(object):
 		#print loop
 		assert (self.count == 0 or self.stop)
 
+		for (k, v) in self.held_stats.items():
+			Logs.debug('runner: %d %s tasks held by the resource budget (%.3fs waiting)' % (v[0], k, v[1]))
+
+		if self.jobserver and not self.count:
+			self.jobserver.close()
+			self.jobserver = None
+
+		if self.procpool:
+			self.procpool.close()
+			self.procpool.join()
+			self.procpool = None
+
@@ -121,6 +121,12 @@ class TaskBase(evil):
 	hcode = ''
 	"""string representing an additional hash for the class representation"""
 
+	cost = 0
+	"""resources used by the task, compared to waf build --budget (a task generator attribute 'cost' has precedence)"""
+
+	concurrency = 0
+	"""maximum amount of tasks of this class (and of its subclasses) running at once, 0 for no limit"""
+
 	def __init__(self, *k, **kw):
 		self.hasrun = NOT_RUN
 
@@ -240,6 +246,14 @@ class Task(TaskBase):
 	"""
 	vars = []
 	shell = False
+
+	process_safe = False
+	"""the method run may be executed in a worker process (waf build --procs=N), in which case it may only use
+	the inputs and outputs (name, abspath, read and write), the env and the attributes listed in process_vars"""
+
+	process_vars = []
+	"""attributes sent to the worker process, and copied back to the task once it has run"""
+
 	def __init__(self, *k, **kw):
 		TaskBase.__init__(self, *k, **kw)
 		self.env = kw['env']
@@ -273,7 +287,7 @@ class Task(TaskBase):
 			return self.uid_
 		except AttributeError:
 			"this is not a real hot zone, but we want to avoid surprizes here"
-			m = Utils.md5()
+			m = Utils.new_hash()
 			up = m.update
 			up(self.__class__.__name__.encode())
 			for x in self.inputs + self.outputs:
@@ -305,7 +319,7 @@ class Task(TaskBase):
 		try: return self.cache_sig
 		except AttributeError: pass
 
-		self.m = Utils.md5()
+		self.m = Utils.new_hash()
 		self.m.update(self.hcode.encode())
 
 		# explicit deps
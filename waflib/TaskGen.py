@@ -374,6 +374,10 @@ def process_rule(self):
 		# bypass the execution of process_source by setting the source to an empty list
 		self.source = []
 
+	# files the task depends on but does not read from its inputs (existing or declared nodes)
+	if getattr(self, 'deps', None):
+		tsk.dep_nodes = self.to_nodes(self.deps)
+
 	if getattr(self, 'scan', None):
 		cls.scan = self.scan
 
@@ -387,6 +391,10 @@ def process_rule(self):
 	if getattr(self, 'always', None):
 		Task.always_run(cls)
 
+	# python functions only, see Task.Task.process_safe
+	if getattr(self, 'process_safe', None) and not isinstance(self.rule, str):
+		cls.process_safe = True
+
 	for x in ['after', 'before', 'ext_in', 'ext_out']:
 		setattr(cls, x, getattr(self, x, []))
 
@@ -434,6 +442,11 @@ class subst_pc(Task.Task):
 	bld(source='foo.pc.in') will create foo.pc which will be installed into ${LIBDIR}/pkgconfig/
 	"""
 
+	process_safe = True
+	process_vars = ['dct', 'quiet', 'dep_vars']
+	dct = None
+	quiet = False
+
 	def run(self):
 		"Substitutes variables in a .in file"
 
@@ -452,21 +465,25 @@ class subst_pc(Task.Task):
 			return ''
 		code = re_m4.sub(repl, code)
 
-		try:
-			d = self.generator.dct
-		except AttributeError:
+		d = self.dct
+		if d is None:
 			d = {}
 			for x in lst:
 				d[x] = self.env.get_flat(x) or self.env.get_flat(x.upper())
-				if not d[x] and not getattr(self.generator, 'quiet', False):
+				if not d[x] and not self.quiet:
 					raise ValueError('variable %r has no value for %r' % (x, self.outputs))
 
 		self.outputs[0].write(code % d)
-		self.generator.bld.raw_deps[self.uid()] = self.dep_vars = lst
+		self.dep_vars = lst
+
+	def post_run(self):
+		"the variables used are known once the task has run (the method run may execute in another process)"
+		self.generator.bld.raw_deps[self.uid()] = self.dep_vars
 
 		# make sure the signature is updated
 		try: delattr(self, 'cache_sig')
 		except AttributeError: pass
+		return super(subst_pc, self).post_run()
 
 	def signature(self):
 		self.dep_vars = self.generator.bld.raw_deps.get(self.uid(), [])
@@ -475,5 +492,7 @@ class subst_pc(Task.Task):
 @extension('.pc.in')
 def add_pcfile(self, node):
 	tsk = self.create_task('subst_pc', node, node.change_ext('.pc'))
+	tsk.dct = getattr(self, 'dct', None)
+	tsk.quiet = getattr(self, 'quiet', False)
 	self.bld.install_files('${LIBDIR}/pkgconfig/', tsk.outputs)
 
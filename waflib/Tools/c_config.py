@@ -6,7 +6,7 @@
 c/c++ configuration routines
 """
 
-import os, imp, sys, shlex, shutil
+import os, imp, sys, shlex, shutil, copy
 from waflib import Build, Utils, Configure, Task, Options, Logs, TaskGen, Errors
 from waflib.TaskGen import before, after, feature
 from waflib.Configure import conf
@@ -143,13 +143,21 @@ def validate_cfg(self, kw):
 	if not 'errmsg' in kw:
 		kw['errmsg'] = 'not found'
 
+PKGCONFIG_VARS = ['PKG_CONFIG_PATH', 'PKG_CONFIG_LIBDIR', 'PKG_CONFIG_SYSROOT_DIR']
+"""environment variables changing the output of pkg-config (see exec_cfg)"""
+
 @conf
 def exec_cfg(self, kw):
 
+	# the outputs are re-used by the next configurations (see ConfigurationContext.cache_check)
+	key = [self.get_program_sig(kw['path'])] + [self.environ.get(x, '') for x in PKGCONFIG_VARS]
+	def run(cmd):
+		return self.cache_check(key + [cmd], self.cmd_and_log, cmd)
+
 	# pkg-config version
 	if 'atleast_pkgconfig_version' in kw:
 		cmd = '%s --atleast-pkgconfig-version=%s' % (kw['path'], kw['atleast_pkgconfig_version'])
-		self.cmd_and_log(cmd)
+		run(cmd)
 		if not 'okmsg' in kw:
 			kw['okmsg'] = 'yes'
 		return
@@ -158,7 +166,7 @@ def exec_cfg(self, kw):
 	for x in cfg_ver:
 		y = x.replace('-', '_')
 		if y in kw:
-			self.cmd_and_log('%s --%s=%s %s' % (kw['path'], x, kw[y], kw['package']))
+			run('%s --%s=%s %s' % (kw['path'], x, kw[y], kw['package']))
 			if not 'okmsg' in kw:
 				kw['okmsg'] = 'yes'
 			self.define(self.have_define(kw.get('uselib_store', kw['package'])), 1, 0)
@@ -166,7 +174,7 @@ def exec_cfg(self, kw):
 
 	# retrieving the version of a module
 	if 'modversion' in kw:
-		version = self.cmd_and_log('%s --modversion %s' % (kw['path'], kw['modversion'])).strip()
+		version = run('%s --modversion %s' % (kw['path'], kw['modversion'])).strip()
 		self.define('%s_VERSION' % Utils.quote_define_name(kw.get('uselib_store', kw['modversion'])), version)
 		return version
 
@@ -179,7 +187,7 @@ def exec_cfg(self, kw):
 
 	# so we assume the command-line will output flags to be parsed afterwards
 	cmd = ' '.join(lst)
-	ret = self.cmd_and_log(cmd)
+	ret = run(cmd)
 	if not 'okmsg' in kw:
 		kw['okmsg'] = 'yes'
 
@@ -442,11 +450,105 @@ def check(self, *k, **kw):
 		return ret == 0
 	return ret
 
+class mem_logger(object):
+	"keep the log messages of a configuration test executed in a thread (see multicheck)"
+	def __init__(self, logger):
+		self.lines = []
+		self.handlers = getattr(logger, 'handlers', [])
+
+	def info(self, msg, *k):
+		if k:
+			msg = msg % k
+		self.lines.append(msg)
+
+	# the output of the commands is logged at other levels (see Context.exec_command)
+	debug = warning = error = info
+
+@conf
+def multicheck(self, *k, **kw):
+	"""
+	execute configuration tests in parallel (-j threads), each test being given as a dict
+	of parameters for conf.check; the messages, the log and the results (defines, variables)
+	are processed in the order of the declaration, as if conf.check was called for each test::
+
+		conf.multicheck({'header_name': 'stdio.h'}, {'header_name': 'foo.h', 'mandatory': False}, {'lib': 'm'})
+
+	the tests must be independent: the environment used for all the tests is the one
+	before the first test. Return the list of results of conf.check.
+	"""
+	tests = []
+	for x in k:
+		dct = dict(x)
+		mandatory = dct.pop('mandatory', True)
+		self.validate_c(dct)
+		# the results of the previous tests are applied to self.env meanwhile
+		env = dct['env'] = dct['env'].derive()
+		env.detach()
+		tests.append((dct, mandatory))
+
+	# each test is executed on a copy of the context with its own logger
+	results = [None] * len(tests)
+	events = [Utils.threading.Event() for x in tests]
+	todo = list(range(len(tests)))
+	def work():
+		while 1:
+			try:
+				i = todo.pop(0)
+			except IndexError:
+				return
+			ctx = copy.copy(self)
+			ctx.logger = mem_logger(self.logger)
+			# the same test may be given twice, do not build in the same folder at the same time
+			ctx.multicheck_index = i
+			try:
+				results[i] = (True, ctx.run_c_code(**tests[i][0]), ctx.logger.lines)
+			except Exception as e:
+				results[i] = (False, e, ctx.logger.lines)
+			events[i].set()
+
+	for x in range(min(Options.options.jobs, len(tests))):
+		t = Utils.threading.Thread(target=work)
+		t.setDaemon(1)
+		t.start()
+
+	ret = []
+	for (i, (dct, mandatory)) in enumerate(tests):
+		self.start_msg(dct['msg'])
+		events[i].wait()
+		(ok, val, lines) = results[i]
+		for line in lines:
+			self.to_log(line)
+		if not ok:
+			if not isinstance(val, self.errors.ConfigurationError):
+				raise val
+			self.end_msg(dct['errmsg'], 'YELLOW')
+			if mandatory:
+				if Logs.verbose > 1:
+					raise val
+				self.fatal('The configuration failed')
+			ret.append(None)
+			continue
+		dct['success'] = val
+		self.end_msg(self.ret_msg(dct['okmsg'], dct))
+		self.post_check(**dct)
+		if dct.get('execute', False):
+			ret.append(val)
+		else:
+			ret.append(val == 0)
+	return ret
+
 class test_exec_task(Task.Task):
 	"""
 	a task for executing a program after it is built
 	"""
 	color = 'PINK'
+	def runnable_status(self):
+		"the program is executed even if it is up-to-date (the output is the result of the test)"
+		ret = super(test_exec_task, self).runnable_status()
+		if ret == Task.SKIP_ME:
+			return Task.RUN_ME
+		return ret
+
 	def run(self):
 		if getattr(self.generator, 'rpath', None):
 			self.generator.bld.retval = self.generator.bld.cmd_and_log([self.inputs[0].abspath()])
@@ -465,11 +567,43 @@ def test_exec_fun(self):
 	"""
 	self.create_task('test_exec', self.link_task.outputs[0])
 
+def is_literal(v):
+	"""
+	return True for the values made of strings, numbers and containers of those; the other
+	values (functions) are left out of the keys of the configuration tests (see run_c_code)
+	"""
+	if isinstance(v, (list, tuple)):
+		for x in v:
+			if not is_literal(x):
+				return False
+		return True
+	if isinstance(v, dict):
+		return is_literal(list(v.keys())) and is_literal(list(v.values()))
+	return v is None or isinstance(v, (str, bytes, int, float, bool))
+
+COMPILER_VARS = ['CC', 'CXX', 'LINK_CC', 'LINK_CXX', 'AR']
+"""variables containing the programs used by the configuration tests (see run_c_code)"""
+
 @conf
 def run_c_code(self, *k, **kw):
+	"""
+	build (and execute) a configuration test; the result is re-used by the next configurations
+	while the parameters, the environment and the compilers do not change (see ConfigurationContext.cache_check)
+	"""
+	env = kw['env']
+	key = ['%s=%r' % (p, v) for (p, v) in sorted(kw.items()) if p != 'env' and is_literal(v)]
+	key.append(repr(sorted(env.get_merged_dict().items())))
+	key.append(self.get_program_sig([env[x] for x in COMPILER_VARS]))
+	return self.cache_check(key, self.exec_c_code, *k, **kw)
+
+@conf
+def exec_c_code(self, *k, **kw):
+	"build (and execute) a configuration test in a temporary build context (see run_c_code)"
 	lst = [str(v) for (p, v) in kw.items() if p != 'env']
 	h = Utils.h_list(lst)
 	dir = self.bldnode.abspath() + os.sep + '.conf_check_' + Utils.to_hex(h)
+	if getattr(self, 'multicheck_index', None) is not None:
+		dir += '_%d' % self.multicheck_index
 
 	try:
 		os.makedirs(dir)
@@ -495,6 +629,8 @@ def run_c_code(self, *k, **kw):
 		node.write(kw['code'])
 
 	bld.logger = self.logger
+	# the tests may run in threads (multicheck), do not share the consumer threads and the jobserver
+	bld.jobs = 1
 	bld.all_envs.update(self.all_envs)
 	bld.all_envs['default'] = kw['env']
 
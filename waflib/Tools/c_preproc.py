@@ -15,6 +15,7 @@ Regarding the speed concerns:
 a. the preprocessing is performed only when files must be compiled
 b. the macros are evaluated only for #if/#elif/#include
 c. system headers are not scanned by default
+d. the headers are processed once for the same values of the macros they use (see header_summary)
 
 Now if you do not want the Waf preprocessor, the tool "gccdeps" uses the .d files produced
 during the compilation to track the dependencies (useful when used with the boost libraries).
@@ -25,7 +26,7 @@ A dumb preprocessor is also available in the tool "c_dumbpreproc"
 # TODO: more varargs, pragma once
 # TODO: dumb file scanner tracking all includes
 
-import re, sys, os, string, traceback
+import re, sys, os, string, traceback, marshal
 from waflib import Logs, Build, Utils, Errors
 from waflib.Logs import debug, error
 
@@ -47,6 +48,15 @@ use_trigraphs = 0
 strict_quotes = 0
 "Keep <> for system includes (do not search for those includes)"
 
+max_summaries = 8
+"amount of header summaries kept for each header (see c_parser.replay)"
+
+TOKEN_CACHE = '.wafpreproc'
+"file in the build directory containing the lines filtered on the previous builds (see token_cache)"
+
+token_cache_age = 20
+"amount of writes of the token cache after which the lines of a file which is not used anymore are removed"
+
 g_optrans = {
 'not':'!',
 'and':'&&',
@@ -111,6 +121,122 @@ def filter_comments(filename):
 	code = re_cpp.sub(repl, code)
 	return [(m.group(2), m.group(3)) for m in re.finditer(re_lines, code)]
 
+class token_cache(object):
+	"""
+	lines filtered on the previous builds (see filter_comments), keyed by file path and
+	signature; the file is read on first use and written with the build data if it changed,
+	also when the build fails (see BuildContext.add_save_fun); the entries record the last
+	write in which they were used, and are removed after token_cache_age writes without use
+	"""
+	def __init__(self, bld):
+		self.path = os.path.join(bld.variant_dir, TOKEN_CACHE)
+		self.table = None
+		self.serial = 0
+		self.used = set([])
+		self.changed = False
+		bld.add_save_fun(self.save)
+
+	def load(self):
+		if self.table is None:
+			self.table = {}
+			try:
+				(ver, trig, serial, tbl) = marshal.loads(Utils.readf(self.path, 'rb'))
+			except (EnvironmentError, EOFError, ValueError, TypeError):
+				pass
+			else:
+				if ver == sys.hexversion and trig == use_trigraphs:
+					self.serial = serial
+					self.table = tbl
+		return self.table
+
+	def get_sig(self, node):
+		"signature of a source file, or None for the files in the build directory"
+		if node.is_bld():
+			return None
+		try:
+			return node.get_bld_sig()
+		except EnvironmentError:
+			return None
+
+	def get(self, node):
+		"filtered lines of a file, or None if the file changed"
+		sig = self.get_sig(node)
+		if sig:
+			try:
+				path = node.abspath()
+				(s, lines, last) = self.load()[path]
+			except KeyError:
+				pass
+			else:
+				if s == sig:
+					self.used.add(path)
+					return lines
+		return None
+
+	def set(self, node, lines):
+		sig = self.get_sig(node)
+		if sig:
+			path = node.abspath()
+			self.load()[path] = (sig, lines, self.serial)
+			self.used.add(path)
+			self.changed = True
+
+	def save(self, bld):
+		if not self.changed:
+			return
+		serial = self.serial + 1
+		table = {}
+		for (k, v) in self.table.items():
+			if k in self.used:
+				table[k] = (v[0], v[1], serial)
+			elif serial - v[2] < token_cache_age:
+				table[k] = v
+		try:
+			data = marshal.dumps((sys.hexversion, use_trigraphs, serial, table))
+		except ValueError:
+			Logs.debug('preproc: cannot marshal the lines of %r' % self.path)
+			return
+
+		f = None
+		try:
+			f = open(self.path + '.tmp', 'wb')
+			f.write(data)
+		finally:
+			if f:
+				f.close()
+		try: os.unlink(self.path)
+		except OSError: pass
+		os.rename(self.path + '.tmp', self.path)
+		(self.serial, self.table) = (serial, table)
+		self.used = set([])
+		self.changed = False
+
+def find_guard(lines):
+	"""
+	return the macro of the include guard of a header (all the lines enclosed in #ifndef X ... #endif)
+	or None; the header has no effect while the macro is defined (see c_parser.skip_guarded)
+	"""
+	if len(lines) < 3 or lines[0][0] != 'ifndef' or lines[-1][0] != POPFILE:
+		return None
+	m = re_mac.search(lines[0][1])
+	if not m:
+		return None
+
+	depth = 0
+	for i in range(len(lines)):
+		token = lines[i][0]
+		if token in ('if', 'ifdef', 'ifndef'):
+			depth += 1
+		elif token == 'endif':
+			depth -= 1
+			if not depth:
+				if i == len(lines) - 2:
+					return m.group(0)
+				return None
+		elif depth == 1 and token in ('else', 'elif'):
+			return None
+	return None
+
 prec = {}
 # op -> number, needed for such expressions:   #if 1 && 2 != 0
 ops = ['* / %', '+ -', '<< >>', '< <= >= >', '== !=', '& | ^', '&& ||', ',']
@@ -314,10 +440,9 @@ def reduce_tokens(lst, defs, ban=[]):
 
 		elif p == IDENT and v in defs:
 
-			if isinstance(defs[v], str):
-				a, b = extract_macro(defs[v])
-				defs[v] = b
 			macro_def = defs[v]
+			if isinstance(macro_def, str):
+				macro_def = get_macro(macro_def)
 			to_add = macro_def[1]
 
 			if isinstance(macro_def[0], list):
@@ -506,6 +631,20 @@ def extract_macro(txt):
 		(p, v) = t[0]
 		return (v, [[], t[1:]])
 
+macro_cache = {}
+"macro definitions already parsed (see get_macro)"
+
+def get_macro(txt):
+	"""
+	parse a macro definition once; the values of the macros are not replaced by the parsed
+	forms, so that the macro states can be compared (see c_parser.replay)
+	"""
+	try:
+		return macro_cache[txt]
+	except KeyError:
+		ret = macro_cache[txt] = extract_macro(txt)[1]
+		return ret
+
 re_include = re.compile('^\s*(<(?P<a>.*)>|"(?P<b>.*)")')
 def extract_include(txt, defs):
 	"""process a line in the form "#include foo" to return a string representing the file"""
@@ -583,15 +722,94 @@ def tokenize(s):
 				break
 	return ret
 
+MISSING = '-undef-'
+"value of the macros not defined in the header summaries"
+
+class header_summary(object):
+	"""
+	what the processing of a header depended on (the macros read and the banned includes tested)
+	and what it produced (macros, includes found or not, banned includes); the summaries are
+	recorded while the headers are processed and replayed when the same values are found again
+	"""
+	__slots__ = ('key', 'name', 'state', 'depth', 'nd', 'files', 'reads', 'writes', 'ban_reads', 'bans',
+		'nodes', 'missing', 'curfile', 'count')
+
+	def __init__(self, parser, path, name, depth):
+		self.key = (path, parser.paths_key)
+		self.name = name
+		self.state = list(parser.state)
+		self.depth = depth
+		self.nd = parser.cache_nd
+		self.files = {}
+		self.reads = {}
+		self.writes = {}
+		self.ban_reads = {}
+		self.bans = set([])
+		self.nodes = len(parser.nodes)
+		self.missing = []
+		self.count = parser.count_files - 1 # the header was counted already
+
+	def read(self, defs, name):
+		"record the value of a macro before the header changes it"
+		if not name in self.writes and not name in self.reads:
+			self.reads[name] = dict.get(defs, name, MISSING)
+
+	def merge(self, other):
+		"add the dependencies and the results of a header processed or replayed in this one"
+		for (k, v) in other.reads.items():
+			if not k in self.writes and not k in self.reads:
+				self.reads[k] = v
+		self.writes.update(other.writes)
+		for (k, v) in other.ban_reads.items():
+			if not k in self.bans and not k in self.ban_reads:
+				self.ban_reads[k] = v
+		self.bans.update(other.bans)
+		self.files.update(other.files)
+		for x in other.missing:
+			if not x in self.missing:
+				self.missing.append(x)
+
+class macro_table(dict):
+	"macro definitions recording the accesses made while the headers are processed (see header_summary)"
+	__slots__ = ('frames',)
+
+	def __init__(self, defines, frames):
+		dict.__init__(self, defines)
+		self.frames = frames
+
+	def __contains__(self, name):
+		if self.frames:
+			self.frames[-1].read(self, name)
+		return dict.__contains__(self, name)
+
+	def __getitem__(self, name):
+		if self.frames:
+			self.frames[-1].read(self, name)
+		return dict.__getitem__(self, name)
+
+	def get(self, name, default=None):
+		if self.frames:
+			self.frames[-1].read(self, name)
+		return dict.get(self, name, default)
+
+	def __setitem__(self, name, value):
+		if self.frames:
+			self.frames[-1].writes[name] = value
+		dict.__setitem__(self, name, value)
+
+	def __delitem__(self, name):
+		if self.frames:
+			self.frames[-1].writes[name] = MISSING
+		dict.__delitem__(self, name)
+
 class c_parser(object):
 	def __init__(self, nodepaths=None, defines=None):
 		#self.lines = txt.split('\n')
 		self.lines = []
 
-		if defines is None:
-			self.defs  = {}
-		else:
-			self.defs  = dict(defines) # make a copy
+		# header summaries being recorded (see header_summary)
+		self.frames = []
+		self.defs = macro_table(defines or {}, self.frames) # make a copy
 		self.state = []
 
 		self.env   = None # needed for the defines when searching for files
@@ -600,13 +818,14 @@ class c_parser(object):
 		self.currentnode_stack = []
 
 		self.nodepaths = nodepaths or []
+		self.paths_key = tuple([id(x) for x in self.nodepaths])
 
 		self.nodes = []
 		self.names = []
 
 		# file added
 		self.curfile = ''
-		self.ban_includes = []
+		self.ban_includes = set([])
 
 	def cached_find_resource(self, node, filename):
 		"""
@@ -641,12 +860,123 @@ class c_parser(object):
 		if not found:
 			if not filename in self.names:
 				self.names.append(filename)
+			if self.frames and not filename in self.frames[-1].missing:
+				self.frames[-1].missing.append(filename)
 		else:
 			self.nodes.append(found)
-			if filename[-4:] != '.moc':
-				self.addlines(found)
+			if filename[-4:] != '.moc' and not self.skip_guarded(found) and not self.replay(found):
+				lines = None
+				try:
+					lines = self.addlines(found)
+				finally:
+					if lines:
+						path = found.abspath()
+						frame = header_summary(self, path, filename, len(self.currentnode_stack))
+						frame.files[path] = lines
+						self.frames.append(frame)
+					else:
+						# the include stack is not consistent anymore, stop recording
+						del self.frames[:]
 		return found
 
+	def skip_guarded(self, node):
+		"""
+		return True if a header read previously is included again while its include guard
+		is defined (see find_guard); the lines of the header would all be skipped
+		"""
+		path = node.abspath()
+		try:
+			lines = self.parse_cache[path]
+		except KeyError:
+			return False
+
+		try:
+			(lns, guard) = self.guards[path]
+		except KeyError:
+			lns = None
+		if lns is not lines:
+			guard = find_guard(lines)
+			self.guards[path] = (lines, guard)
+
+		if guard and guard in self.defs:
+			self.count_files += 1
+			if self.count_files > 30000: raise PreprocError("recursion limit exceeded")
+			return True
+		return False
+
+	def replay(self, node):
+		"""
+		add the results of a header summary recorded previously for the same macro values,
+		return True if a summary was used (see header_summary)
+		"""
+		pc = self.parse_cache
+		try:
+			lst = pc[(node.abspath(), self.paths_key)]
+		except KeyError:
+			return False
+
+		defs = self.defs
+		for sm in lst:
+			if sm.name != self.curfile or sm.state != self.state or sm.nd is not self.cache_nd:
+				continue
+			for (k, v) in sm.files.items():
+				if pc.get(k) is not v:
+					break
+			else:
+				for (k, v) in sm.reads.items():
+					if dict.get(defs, k, MISSING) != v:
+						break
+				else:
+					for (k, v) in sm.ban_reads.items():
+						if (k in self.ban_includes) != v:
+							break
+					else:
+						break
+		else:
+			return False
+
+		debug('preproc: replaying %r', sm.name)
+		for (k, v) in sm.writes.items():
+			if v is MISSING:
+				dict.pop(defs, k, None)
+			else:
+				dict.__setitem__(defs, k, v)
+		self.nodes.extend(sm.nodes)
+		for x in sm.missing:
+			if not x in self.names:
+				self.names.append(x)
+		self.ban_includes.update(sm.bans)
+		self.curfile = sm.curfile
+		self.count_files += sm.count
+		if self.frames:
+			self.frames[-1].merge(sm)
+		return True
+
+	def pop_frame(self):
+		"store the summary of a header processed (see header_summary)"
+		sm = self.frames.pop()
+		if sm.state == self.state:
+			# the conditional blocks are balanced, the summary can be replayed
+			sm.nodes = self.nodes[sm.nodes:]
+			sm.curfile = self.curfile
+			sm.count = self.count_files - sm.count
+			lst = self.parse_cache.get(sm.key, [])
+			self.parse_cache[sm.key] = [sm] + lst[:max_summaries - 1]
+		if self.frames:
+			self.frames[-1].merge(sm)
+
+	def is_banned(self, inc):
+		frames = self.frames
+		ret = inc in self.ban_includes
+		if frames and not inc in frames[-1].bans and not inc in frames[-1].ban_reads:
+			frames[-1].ban_reads[inc] = ret
+		return ret
+
+	def ban(self, inc):
+		self.ban_includes.add(inc)
+		if self.frames:
+			self.frames[-1].bans.add(inc)
+
 	def addlines(self, node):
 
 		self.currentnode_stack.append(node.parent)
@@ -662,13 +992,24 @@ class c_parser(object):
 			pass
 		else:
 			self.lines = lns + self.lines
-			return
+			return lns
+
+		tc = self.token_cache
+		if tc:
+			lines = tc.get(node)
+			if lines:
+				pc[filepath] = lines
+				self.lines = lines + self.lines
+				return lines
 
 		try:
 			lines = filter_comments(filepath)
 			lines.append((POPFILE, ''))
 			pc[filepath] = lines # cache the lines filtered
+			if tc:
+				tc.set(node, lines)
 			self.lines = lines + self.lines
+			return lines
 		except IOError:
 			raise PreprocError("could not read the file %s" % filepath)
 		except Exception:
@@ -686,6 +1027,21 @@ class c_parser(object):
 		except AttributeError:
 			bld.parse_cache = {}
 			self.parse_cache = bld.parse_cache
+		try:
+			self.cache_nd = bld.cache_nd
+		except AttributeError:
+			self.cache_nd = bld.cache_nd = {}
+		try:
+			self.guards = bld.guard_cache
+		except AttributeError:
+			self.guards = bld.guard_cache = {}
+		try:
+			self.token_cache = bld.token_cache
+		except AttributeError:
+			# only the build contexts have a build directory
+			self.token_cache = None
+			if isinstance(bld, Build.BuildContext):
+				self.token_cache = bld.token_cache = token_cache(bld)
 
 		self.addlines(node)
 
@@ -697,6 +1053,8 @@ class c_parser(object):
 		while self.lines:
 			(kind, line) = self.lines.pop(0)
 			if kind == POPFILE:
+				if self.frames and self.frames[-1].depth == len(self.currentnode_stack):
+					self.pop_frame()
 				self.currentnode_stack.pop()
 				continue
 			try:
@@ -735,8 +1093,8 @@ class c_parser(object):
 			else: state[-1] = accepted
 		elif token == 'include' or token == 'import':
 			(kind, inc) = extract_include(line, self.defs)
-			if inc in self.ban_includes: return
-			if token == 'import': self.ban_includes.append(inc)
+			if self.is_banned(inc): return
+			if token == 'import': self.ban(inc)
 			if ve: debug('preproc: include found %s    (%s)', inc, kind)
 			if kind == '"' or not strict_quotes:
 				self.tryfind(inc)
@@ -764,7 +1122,7 @@ class c_parser(object):
 				#print "undef %s" % name
 		elif token == 'pragma':
 			if re_pragma_once.search(line.lower()):
-				self.ban_includes.append(self.curfile)
+				self.ban(self.curfile)
 
 def get_deps(task):
 	"""
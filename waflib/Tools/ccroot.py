@@ -99,6 +99,7 @@ class link_task(Task.Task):
 	color   = 'YELLOW'
 	inst_to = None
 	chmod   = Utils.O644
+	cost    = 1 # links use lots of memory, see waf build --budget
 
 	def add_target(self, target):
 		if isinstance(target, str):
@@ -119,6 +120,7 @@ class link_task(Task.Task):
 
 class stlink_task(link_task):
 	run_str = '${AR} ${ARFLAGS} ${AR_TGT_F}${TGT} ${AR_SRC_F}${SRC}'
+	cost    = 0
 	def run(self):
 		"""remove the file before creating it (ar behaviour is to append to the existin file)"""
 		try:
@@ -6,7 +6,7 @@
 Utilities and cross-platform fixes.
 """
 
-import os, sys, errno, traceback, inspect, re, shutil, datetime, gc
+import os, sys, errno, traceback, inspect, re, shutil, datetime, gc, functools, time
 import subprocess # leave this line exactly as it is (enable module replacement if necessary)
 from collections import deque # do not touch
 from waflib import Errors
@@ -51,6 +51,84 @@ else:
 SIG_NIL = b'iluvcuteoverload'
 """if you change the hash type, do not forget to change SIG_NIL"""
 
+class trunc_hash(object):
+	"hash object returning the first 16 bytes of the digests (same size as SIG_NIL)"
+	__slots__ = ('m',)
+	def __init__(self, m):
+		self.m = m
+	def update(self, s):
+		self.m.update(s)
+	def digest(self):
+		return self.m.digest()[:16]
+
+hash_engines = {'md5': md5}
+"""hash functions for the signatures (name -> function returning a new hash object)"""
+
+try:
+	from hashlib import sha1
+except ImportError:
+	pass
+else:
+	hash_engines['sha1'] = lambda: trunc_hash(sha1())
+
+try:
+	from hashlib import blake2b
+except ImportError:
+	pass
+else:
+	hash_engines['blake2b'] = functools.partial(blake2b, digest_size=16)
+
+try:
+	import xxhash
+except ImportError:
+	pass
+else:
+	# not a cryptographic hash function, but much faster on large files
+	# the names differ so that the build data is discarded when xxhash is upgraded
+	xxh128 = getattr(xxhash, 'xxh3_128', None) or getattr(xxhash, 'xxh128', None)
+	if xxh128:
+		hash_engines['xxh128'] = xxh128
+	else:
+		class xxh64_pair(object):
+			"two 64-bit xxhash digests with different seeds (same size as SIG_NIL)"
+			__slots__ = ('a', 'b')
+			def __init__(self):
+				self.a = xxhash.xxh64(seed=0)
+				self.b = xxhash.xxh64(seed=1)
+			def update(self, s):
+				self.a.update(s)
+				self.b.update(s)
+			def digest(self):
+				return self.a.digest() + self.b.digest()
+		hash_engines['xxh64'] = xxh64_pair
+
+def set_hash_engine(name):
+	"""
+	Select the hash function used for the file and task signatures (see hash_engines). The name
+	is recorded in the build database, which is discarded when the hash function changes.
+	@type  name: string
+	@param name: key in hash_engines
+	"""
+	global hash_engine, new_hash
+	try:
+		new_hash = hash_engines[name]
+	except KeyError:
+		raise Errors.WafError('Unknown hash function %r (available: %s)' % (name, ', '.join(sorted(hash_engines.keys()))))
+	hash_engine = name
+
+hash_engine = None
+"""name of the hash function in use, set by set_hash_engine"""
+
+new_hash = None
+"""function returning a new hash object (md5, blake2b, ...), set by set_hash_engine"""
+
+default_engine = 'blake2b' in hash_engines and 'blake2b' or 'md5'
+try:
+	set_hash_engine(os.environ.get('WAF_HASH', default_engine))
+except Errors.WafError as e:
+	sys.stderr.write('%s, using %s\n' % (e, default_engine))
+	set_hash_engine(default_engine)
+
 O644 = 420
 """permission for regular files"""
 
@@ -93,14 +171,71 @@ def readf(fname, m='r'):
 		f.close()
 	return txt
 
+try:
+	import mmap
+except ImportError:
+	mmap = None
+
+HASH_CHUNK = 262144
+"""size of the reads in h_file (readinto in a buffer re-used by each thread)"""
+
+HASH_MMAP = 4194304
+"""files of this size or larger are mapped in memory to be hashed by h_file"""
+
+HASH_MMAP_DELAY = 2.0
+"""
+files modified less than HASH_MMAP_DELAY seconds before being hashed may still be written,
+they are read instead of being mapped (truncating a mapped file raises SIGBUS)
+"""
+
+try:
+	memoryview
+except NameError:
+	# python 2.6, the slices are copies
+	memoryview = lambda x: x
+
+try:
+	hash_buffers = threading.local()
+except AttributeError:
+	hash_buffers = None
+
 def h_file(filename):
-	f = open(filename, 'rb')
-	m = md5()
-	while (filename):
-		filename = f.read(100000)
-		m.update(filename)
-	f.close()
-	return m.digest()
+	"""
+	Hash the contents of a file (see new_hash). The large files which were not modified recently
+	are mapped in memory, the others are read in a buffer re-used by the thread, to avoid creating
+	a string for each read.
+	@type  filename: string
+	@param filename: Path to the file
+	@rtype: string
+	@return: Digest of the file contents
+	"""
+	f = open(filename, 'rb', 0)
+	try:
+		m = new_hash()
+		st = os.fstat(f.fileno())
+		if mmap and st.st_size >= HASH_MMAP and time.time() - st.st_mtime > HASH_MMAP_DELAY:
+			mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+			try:
+				m.update(mm)
+			finally:
+				mm.close()
+			return m.digest()
+
+		try:
+			(buf, view) = hash_buffers.buf
+		except AttributeError:
+			buf = bytearray(HASH_CHUNK)
+			view = memoryview(buf)
+			if hash_buffers is not None:
+				hash_buffers.buf = (buf, view)
+		while 1:
+			n = f.readinto(buf)
+			if not n:
+				break
+			m.update(n == HASH_CHUNK and view or view[:n])
+		return m.digest()
+	finally:
+		f.close()
 
 try:
 	x = ''.encode('hex')
@@ -263,8 +398,8 @@ def trimquotes(s):
 	return s
 
 def h_list(lst):
-	"""Hash a list."""
-	m = md5()
+	"""Hash a list (see new_hash)."""
+	m = new_hash()
 	m.update(str(lst).encode())
 	return m.digest()
 
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Thomas Nagy, 2010 (ita)
+
+"""
+Compile the c/c++ files of a task generator by batches: one compiler process
+for many files (gcc -c a.c b.c ...) instead of one process per file::
+
+	def configure(conf):
+		conf.check_tool('gcc batched_cc')
+	def build(bld):
+		bld.program(source='main.c foo.c bar.c', target='app')
+		bld.program(source='main.c', target='app2', batch=False) # disable for a task generator
+
+The compilation tasks are still created and keep their own signatures; when a task
+must run, it waits for the batch task of its task generator, which compiles all
+the files needing it at once in a temporary folder and moves the object files to their
+locations. A failed batch is compiled again one file at a time to report the errors.
+
+Only the gcc-like compilers are supported (-c without -o), the object files are
+named after the source files so the files of a batch must have different names.
+"""
+
+import os, sys, shutil, tempfile
+from waflib import Task, Utils, Logs
+from waflib.TaskGen import taskgen_method
+from waflib.Tools import ccroot, c, cxx
+
+MAX_BATCH = 50
+"""maximum amount of files compiled by a process"""
+
+compilers = {'c': ('CC_NAME', ['gcc', 'icc']), 'cxx': ('CXX_NAME', ['gcc', 'icc'])}
+"""task class -> (variable for the compiler name, compilers accepting several source files)"""
+
+class batch_task(Task.Task):
+	"compile the files of several compilation tasks (slaves) by a single process"
+	color = 'CYAN'
+	shell = False
+
+	def __init__(self, *k, **kw):
+		Task.Task.__init__(self, *k, **kw)
+		self.slaves = []
+		self.torun = []
+
+	def add_slave(self, tsk):
+		self.slaves.append(tsk)
+		self.inputs.extend(tsk.inputs)
+		tsk.batch = self
+
+	def __str__(self):
+		return '%s: %s\n' % (self.__class__.__name__.replace('_batch', ''), ' '.join([t.inputs[0].nice_path(self.env) for t in self.torun]))
+
+	def runnable_status(self):
+		for t in self.slaves:
+			if not t.hasrun and not t in self.torun:
+				return Task.ASK_LATER
+		if self.torun:
+			return Task.RUN_ME
+		return Task.SKIP_ME
+
+	def call_run(self):
+		"the method run executes the compiler (run_str), see run_batch"
+		bld = self.generator.bld
+		self.cwd = tempfile.mkdtemp(prefix='.batch-', dir=bld.variant_dir)
+		try:
+			# the object files are named after the source files, compile the duplicates separately
+			lst = []
+			for t in self.torun:
+				name = os.path.splitext(t.inputs[0].name)[0]
+				for batch in lst:
+					if len(batch) < MAX_BATCH and not name in batch:
+						batch[name] = t
+						break
+				else:
+					lst.append({name: t})
+
+			for batch in lst:
+				self.run_batch(batch)
+			# the errors are reported on the compilation tasks (see slave_done)
+			return 0
+		finally:
+			shutil.rmtree(self.cwd, ignore_errors=True)
+			self.torun = []
+
+	def run_batch(self, batch):
+		"compile the files, or compile them one by one if the compilation fails"
+		self.batch_sources = [t.inputs[0].abspath() for t in batch.values()]
+		if not self.run():
+			for (name, t) in batch.items():
+				try:
+					os.rename(os.path.join(self.cwd, name + '.o'), t.outputs[0].abspath())
+				except OSError:
+					shutil.move(os.path.join(self.cwd, name + '.o'), t.outputs[0].abspath())
+				self.slave_done(t, 0)
+			return
+
+		Logs.debug('runner: batch failed, compiling the files one by one')
+		for t in batch.values():
+			self.slave_done(t, t.run())
+
+	def exec_command(self, cmd, **kw):
+		"""
+		the output of a batch is displayed only if the compilation succeeds (warnings), the files
+		of a failed batch are compiled again one by one and display their own errors
+		"""
+		f = tempfile.TemporaryFile()
+		try:
+			kw['stdout'] = kw['stderr'] = f
+			ret = Task.Task.exec_command(self, cmd, **kw)
+			if not ret:
+				f.seek(0)
+				out = f.read()
+				if out:
+					sys.stderr.write(out.decode(sys.stdout.encoding or 'iso8859-1', 'replace'))
+			return ret
+		finally:
+			f.close()
+
+	def slave_done(self, t, ret):
+		"""
+		update the signature of a slave and mark it as run; the failures go through the error
+		handler of the build, as if the slave was executed by itself (see Runner.process_task)
+		"""
+		if ret:
+			t.err_code = ret
+			t.hasrun = Task.CRASHED
+		else:
+			try:
+				t.post_run()
+			except Exception:
+				t.err_msg = Utils.ex_stack()
+				t.hasrun = Task.EXCEPTION
+			else:
+				t.hasrun = Task.SUCCESS
+		if t.hasrun != Task.SUCCESS:
+			self.master.error_handler(t)
+
+	def post_run(self):
+		"the signatures are those of the slaves"
+		pass
+
+class c_batch(batch_task):
+	run_str = '${CC} ${CCFLAGS} ${CPPFLAGS} ${FRAMEWORKPATH_ST:FRAMEWORKPATH} ${CPPPATH_ST:INCPATHS} ${DEFINES_ST:DEFINES} -c ${tsk.batch_sources}'
+
+class cxx_batch(batch_task):
+	run_str = '${CXX} ${CXXFLAGS} ${CPPFLAGS} ${FRAMEWORKPATH_ST:FRAMEWORKPATH} ${CPPPATH_ST:INCPATHS} ${DEFINES_ST:DEFINES} -c ${tsk.batch_sources}'
+
+@taskgen_method
+def create_compiled_task(self, name, node):
+	"""
+	attach the compilation tasks to a batch task of the task generator, if the compiler
+	supports it (see ccroot.create_compiled_task)
+	"""
+	task = ccroot.create_compiled_task(self, name, node)
+	try:
+		(var, names) = compilers[name]
+	except KeyError:
+		return task
+	if not getattr(self, 'batch', True) or not self.env[var] in names:
+		return task
+
+	try:
+		batches = self.batches
+	except AttributeError:
+		batches = self.batches = {}
+	master = batches.get(name, None)
+	if not master or len(master.slaves) >= MAX_BATCH:
+		master = batches[name] = self.create_task(name + '_batch')
+	master.add_slave(task)
+	return task
+
+def runnable_status(self):
+	"the compilation tasks to run wait for their batch task (see batch_task.run)"
+	master = getattr(self, 'batch', None)
+	if master:
+		if self in master.torun:
+			return Task.ASK_LATER
+		ret = self.runnable_status_batch()
+		if ret == Task.RUN_ME:
+			master.torun.append(self)
+			return Task.ASK_LATER
+		return ret
+	return self.runnable_status_batch()
+
+for x in compilers:
+	try:
+		cls = Task.classes[x]
+	except KeyError:
+		continue
+	cls.runnable_status_batch = cls.runnable_status
+	cls.runnable_status = runnable_status
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Thomas Nagy, 2010 (ita)
+
+"""
+Keep a waf process running to avoid the startup costs (loading the build database,
+reading the wscript files, creating the task generators and the tasks) on each build::
+
+	def options(opt):
+		opt.tool_options('build_server')
+
+	$ waf server &
+	$ waf build --use-server
+	$ waf install --use-server --targets=app
+
+The client forwards the commands 'build', 'install' and 'step' and the command-line options
+to the server through a unix socket, and displays the output (progress, logs, compiler
+messages) sent back. The commands are executed locally when no server is running.
+
+The server keeps a build context for each command; the wscript files are not read again
+(and the task generators are kept) unless a wscript file, the configuration or the build
+database (another waf process) changes. The files are signed again for each build.
+Note that new files matched by globs in the wscript files are then only noticed after
+a change of the wscript files.
+"""
+
+import os, sys, socket, traceback
+try:
+	import json
+except ImportError:
+	json = None
+from waflib import Context, Task, Scripting, Options, Logs, Errors, Utils
+
+commands = ['build', 'install', 'step']
+"""commands that may be forwarded to the server"""
+
+def options(opt):
+	opt.add_option('--use-server', action='store_true', default=False, dest='use_server',
+		help='forward the commands %s to a build server (waf server)' % ', '.join(commands))
+	opt.add_option('--server-socket', action='store', default='', dest='server_socket',
+		help='unix socket of the build server [default: .waf-server in the build directory]')
+
+def get_address():
+	return Options.options.server_socket or os.path.join(Context.out_dir or Context.run_dir, '.waf-server')
+
+# ------------------------------------------------------------------
+# client side
+
+def forward(args):
+	"""
+	send the command-line to the server and copy the output received to the standard output,
+	return the exit status or None if the server cannot be reached
+	"""
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		sock.connect(get_address())
+	except socket.error as e:
+		Logs.debug('server: cannot connect to %r (%s)' % (get_address(), e))
+		sock.close()
+		return None
+
+	req = {'args': args, 'cwd': Context.launch_dir, 'colors': Logs.colors_lst['USE']}
+	sock.sendall((json.dumps(req) + '\n').encode())
+
+	# the output is followed by a null byte and the exit status
+	out = getattr(sys.stdout, 'buffer', sys.stdout)
+	status = None
+	try:
+		while 1:
+			data = sock.recv(65536)
+			if not data:
+				break
+			if status is None:
+				idx = data.find(b'\0')
+				if idx < 0:
+					out.write(data)
+					out.flush()
+					continue
+				out.write(data[:idx])
+				out.flush()
+				status = data[idx + 1:]
+			else:
+				status += data
+	finally:
+		sock.close()
+	try:
+		return int(status)
+	except (TypeError, ValueError):
+		Logs.error('The build server closed the connection')
+		return 2
+
+old_run_commands = Scripting.run_commands
+def run_commands():
+	"forward the commands to the server if --use-server is given"
+	if getattr(Options.options, 'use_server', False) and json and Options.commands:
+		lst = [x for x in Options.commands if not x in commands]
+		if lst:
+			raise Errors.WafError('Only the commands %r can be forwarded to the server (not %r)' % (commands, lst))
+		ret = forward([x for x in sys.argv[1:] if x != '--use-server'])
+		if ret is not None:
+			sys.exit(ret)
+		Logs.warn('No build server is running, executing the commands locally')
+	old_run_commands()
+Scripting.run_commands = run_commands
+
+# ------------------------------------------------------------------
+# server side
+
+def rebuild(ctx):
+	"execute a build context again, without reading the wscript files (see BuildContext.execute_build)"
+	for g in ctx.groups:
+		for tg in g:
+			if isinstance(tg, Task.TaskBase):
+				lst = [tg]
+			else:
+				lst = getattr(tg, 'tasks', [])
+			for tsk in lst:
+				tsk.hasrun = Task.NOT_RUN
+				try:
+					del tsk.cache_sig
+				except AttributeError:
+					pass
+
+	# the files may have changed since the previous build
+	ctx.hash_cache = {}
+	ctx.parse_cache = {}
+	ctx.cache_nd = {}
+
+	ctx.targets = Options.options.targets
+	ctx.launch_dir = Context.launch_dir
+	if hasattr(ctx, 'files'):
+		ctx.files = Options.options.files
+
+	Logs.info("Waf: Entering directory `%s'" % ctx.variant_dir)
+	ctx.pre_build()
+	ctx.timer = Utils.Timer()
+	if Options.options.progress_bar:
+		sys.stderr.write(Logs.colors.cursor_off)
+	try:
+		ctx.compile()
+	finally:
+		if Options.options.progress_bar:
+			sys.stderr.write(Logs.colors.cursor_on)
+			print('')
+		Logs.info("Waf: Leaving directory `%s'" % ctx.variant_dir)
+	ctx.post_build()
+
+class ServerContext(Context.Context):
+	"""runs a build server (see waflib/extras/build_server.py)"""
+	cmd = 'server'
+
+	def execute(self):
+		if not json:
+			raise Errors.WafError('The module json is required by the build server (Python >= 2.6)')
+		self.contexts = {}
+
+		addr = get_address()
+		if os.path.exists(addr):
+			os.remove(addr)
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		sock.bind(addr)
+		sock.listen(5)
+		Logs.info('Waf build server listening on %s' % addr)
+		try:
+			while 1:
+				(conn, a) = sock.accept()
+				try:
+					self.serve(conn)
+				finally:
+					conn.close()
+		finally:
+			sock.close()
+			os.remove(addr)
+
+	def serve(self, conn):
+		"read a command-line, execute it with the output redirected to the client"
+		buf = b''
+		while not b'\n' in buf:
+			data = conn.recv(4096)
+			if not data:
+				return
+			buf += data
+		req = json.loads(buf.split(b'\n')[0].decode())
+
+		sys.stdout.flush()
+		sys.stderr.flush()
+		saved = (os.dup(1), os.dup(2))
+		(argv, colors, launch_dir) = (sys.argv, Logs.colors_lst['USE'], Context.launch_dir)
+		os.dup2(conn.fileno(), 1)
+		os.dup2(conn.fileno(), 2)
+		try:
+			ret = self.run(req)
+		finally:
+			try:
+				sys.stdout.flush()
+				sys.stderr.flush()
+			except (IOError, OSError):
+				pass
+			os.dup2(saved[0], 1)
+			os.dup2(saved[1], 2)
+			os.close(saved[0])
+			os.close(saved[1])
+			(sys.argv, Logs.colors_lst['USE'], Context.launch_dir) = (argv, colors, launch_dir)
+		try:
+			conn.sendall(b'\0' + str(ret).encode())
+		except socket.error:
+			pass
+		Logs.info('Request %r: exit status %d' % (' '.join(req['args']), ret))
+
+	def run(self, req):
+		"execute the commands of a request, return the exit status"
+		sys.argv = [sys.argv[0]] + req['args']
+		Logs.colors_lst['USE'] = req['colors']
+		Context.launch_dir = req['cwd']
+		try:
+			Scripting.parse_options()
+			for cmd in Options.commands:
+				if not cmd in commands:
+					raise Errors.WafError('The command %r cannot be executed by the build server' % cmd)
+			while Options.commands:
+				cmd = Options.commands.pop(0)
+				timer = Utils.Timer()
+				self.run_command(cmd)
+				if not Options.options.progress_bar:
+					Logs.info('%r finished successfully (%s)' % (cmd, timer))
+		except Errors.WafError as e:
+			if Logs.verbose > 1:
+				Logs.pprint('RED', e.verbose_msg)
+			Logs.error(e.msg)
+			return 1
+		except Exception:
+			traceback.print_exc(file=sys.stdout)
+			return 2
+		return 0
+
+	def run_command(self, cmd):
+		"execute a command with the build context kept from a previous request if possible"
+		ctx = self.contexts.pop(cmd, None)
+		if ctx and ctx.server_sig == self.get_sig(ctx):
+			fun = rebuild
+		else:
+			if ctx:
+				Logs.info('Waf: the project changed, reading the wscript files')
+				for x in ctx.wscripts:
+					Context.cache_modules.pop(x, None)
+				Scripting.set_main_module(Context.g_module.root_path)
+			ctx = Context.create_context(cmd)
+			ctx.cmd = cmd
+			ctx.wscripts = []
+			def pre_recurse(node, fun=ctx.pre_recurse):
+				ctx.wscripts.append(node.abspath())
+				fun(node)
+			ctx.pre_recurse = pre_recurse
+			fun = ctx.__class__.execute
+
+		# the task generators are kept if the wscript files could be read
+		try:
+			fun(ctx)
+		except Errors.BuildError:
+			self.keep(cmd, ctx)
+			raise
+		self.keep(cmd, ctx)
+
+	def keep(self, cmd, ctx):
+		ctx.server_sig = self.get_sig(ctx)
+		self.contexts[cmd] = ctx
+
+	def get_sig(self, ctx):
+		"hash of the wscript files, of the configuration and of the status of the build database"
+		m = Utils.md5()
+		for x in [Context.g_module.root_path] + ctx.wscripts:
+			try:
+				m.update(Utils.h_file(x))
+			except (IOError, OSError):
+				m.update(b'-')
+		lst = [os.path.join(ctx.variant_dir, x) for x in (Context.DBFILE, Context.SQLITE_DBFILE, Context.SQLITE_DBFILE + '-wal')]
+		try:
+			lst.extend([os.path.join(ctx.cache_dir, x) for x in sorted(Utils.listdir(ctx.cache_dir))])
+		except OSError:
+			pass
+		for x in lst:
+			try:
+				st = os.stat(x)
+			except OSError:
+				m.update(b'-')
+			else:
+				m.update(str((x, st.st_size, st.st_mtime)).encode())
+		return m.digest()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Thomas Nagy, 2010 (ita)
+
+"""
+Record a timeline of the build in the Chrome trace-event format (chrome://tracing, Perfetto)::
+
+	def options(opt):
+		opt.tool_options('build_trace')
+
+	$ waf build --trace=build.json
+
+The tasks are displayed on the threads that executed them (class, task generator, status),
+the skipped tasks are instant events on the main thread, and the main thread phases
+(recurse, post_group, set_file_constraints, set_precedence_constraints, signature, save)
+are recorded too. The time spent by the tasks waiting on the resource budget (--budget)
+is displayed on a separate line.
+"""
+
+import os, time, threading
+try:
+	import json
+except ImportError:
+	json = None
+try:
+	from queue import Queue
+except ImportError:
+	from Queue import Queue
+from waflib import Task, Runner, Build, Context, Options, Logs
+
+def options(opt):
+	opt.add_option('--trace', action='store', default='', dest='trace',
+		help='write a timeline of the build in the Chrome trace-event format, e.g. --trace=build.json')
+
+events = []
+"""trace events recorded so far"""
+
+threads = {}
+"""thread identifiers -> small integers for the trace"""
+
+origin = time.time()
+
+BUDGET_TID = 0
+"""line for the tasks held by the resource budget"""
+
+status_names = {
+	Task.SUCCESS: 'success',
+	Task.SKIPPED: 'skipped',
+	Task.CRASHED: 'crashed',
+	Task.EXCEPTION: 'exception',
+	Task.MISSING: 'missing',
+	Task.NOT_RUN: 'not run',
+}
+
+def enabled():
+	return json and getattr(Options.options, 'trace', '')
+
+def get_tid():
+	"identifier of the current thread in the trace"
+	t = threading.currentThread()
+	try:
+		return threads[t]
+	except KeyError:
+		ret = threads[t] = len(threads) + 1
+		return ret
+
+def add_event(name, cat, start, end, tid=None, args=None):
+	"add a complete event, the times are in seconds"
+	evt = {'name': name, 'cat': cat, 'ph': 'X', 'pid': 1,
+		'tid': tid is None and get_tid() or tid,
+		'ts': int((start - origin) * 1000000),
+		'dur': int((end - start) * 1000000)}
+	if args:
+		evt['args'] = args
+	events.append(evt)
+
+def task_args(tsk):
+	gen = tsk.generator
+	return {'class': tsk.__class__.__name__,
+		'generator': gen is not tsk and getattr(gen, 'name', '') or '',
+		'status': status_names.get(tsk.hasrun, str(tsk.hasrun))}
+
+def task_name(tsk):
+	try:
+		return str(tsk).strip() or tsk.__class__.__name__
+	except Exception:
+		return tsk.__class__.__name__
+
+def timed(name, fun):
+	"record the calls of a function on the current thread"
+	def f(*k, **kw):
+		if not enabled():
+			return fun(*k, **kw)
+		t = time.time()
+		try:
+			return fun(*k, **kw)
+		finally:
+			add_event(name, 'phase', t, time.time())
+	f.__doc__ = fun.__doc__
+	return f
+
+def write_trace(filename):
+	"write the events recorded so far"
+	lst = [{'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': v, 'args': {'name': k.getName()}} for (k, v) in threads.items()]
+	lst.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': BUDGET_TID, 'args': {'name': 'budget'}})
+	f = open(filename, 'w')
+	try:
+		json.dump({'traceEvents': lst + events, 'displayTimeUnit': 'ms'}, f)
+	finally:
+		f.close()
+	Logs.info('Trace written to %r (%d events)' % (filename, len(events)))
+
+# ------------------------------------------------------------------
+# tasks
+
+class trace_queue(Queue):
+	"""
+	the tasks are recorded when the consumers hand them back, before the producer
+	may end the build (see Runner.process_task)
+	"""
+	def put(self, tsk, *k, **kw):
+		try:
+			(start, tid) = tsk.trace_start
+		except AttributeError:
+			pass
+		else:
+			del tsk.trace_start
+			add_event(task_name(tsk), 'task', start, time.time(), tid, task_args(tsk))
+			wait = getattr(tsk, 'budget_wait', 0)
+			if wait:
+				add_event(task_name(tsk), 'budget', start - wait, start, BUDGET_TID, {'class': tsk.__class__.__name__})
+		Queue.put(self, tsk, *k, **kw)
+
+old_process_task = Runner.process_task
+def process_task(tsk):
+	if enabled():
+		tsk.trace_start = (time.time(), get_tid())
+	old_process_task(tsk)
+Runner.process_task = process_task
+
+old_init = Runner.Parallel.__init__
+def init(self, *k, **kw):
+	old_init(self, *k, **kw)
+	if enabled():
+		self.out = trace_queue(0)
+Runner.Parallel.__init__ = init
+
+def wrap_runnable_status(cls):
+	"record the skipped tasks (once, the method may call the one of a parent class)"
+	fun = cls.__dict__['runnable_status']
+	if getattr(fun, 'traced', False):
+		return
+	def runnable_status(self):
+		ret = fun(self)
+		if ret == Task.SKIP_ME and enabled() and not getattr(self, 'trace_skip', False):
+			self.trace_skip = True
+			events.append({'name': task_name(self), 'cat': 'skip', 'ph': 'i', 's': 't', 'pid': 1,
+				'tid': get_tid(), 'ts': int((time.time() - origin) * 1000000),
+				'args': {'class': self.__class__.__name__, 'status': 'skipped'}})
+		return ret
+	runnable_status.traced = True
+	cls.runnable_status = runnable_status
+
+old_signature = Task.Task.signature
+def signature(self):
+	"the signatures are recorded only when computed (not cached)"
+	if hasattr(self, 'cache_sig') or not enabled():
+		return old_signature(self)
+	t = time.time()
+	try:
+		return old_signature(self)
+	finally:
+		add_event('signature', 'phase', t, time.time(), None, {'task': task_name(self)})
+Task.Task.signature = signature
+
+# ------------------------------------------------------------------
+# main thread phases
+
+Context.Context.recurse = timed('recurse', Context.Context.recurse)
+Build.BuildContext.post_group = timed('post_group', Build.BuildContext.post_group)
+Build.BuildContext.save = timed('save', Build.BuildContext.save)
+Task.set_file_constraints = timed('set_file_constraints', Task.set_file_constraints)
+Task.set_precedence_constraints = timed('set_precedence_constraints', Task.set_precedence_constraints)
+
+old_compile = Build.BuildContext.compile
+def compile(self):
+	"write the trace file once the build is over, even if it failed"
+	if not enabled():
+		return old_compile(self)
+	for cls in set(Task.classes.values()):
+		for x in cls.__mro__:
+			if 'runnable_status' in x.__dict__:
+				wrap_runnable_status(x)
+	t = time.time()
+	try:
+		old_compile(self)
+	finally:
+		add_event('compile', 'phase', t, time.time())
+		write_trace(os.path.join(Context.launch_dir, Options.options.trace))
+Build.BuildContext.compile = compile
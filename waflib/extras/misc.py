@@ -62,6 +62,7 @@ def apply_copy(self):
 
 		tsk = self.create_task('copy', node, newnode)
 		tsk.fun = self.fun
+		tsk.process_safe = self.fun in PROCESS_SAFE
 		tsk.chmod = getattr(self, 'chmod', Utils.O644)
 
 		if not tsk.env:
@@ -127,6 +128,7 @@ def apply_subst(self):
 
 		tsk = self.create_task('copy', node, newnode)
 		tsk.fun = self.fun
+		tsk.process_safe = self.fun in PROCESS_SAFE
 		tsk.dict = self.dict
 		tsk.dep_vars = ['DICT_HASH']
 		tsk.chmod = getattr(self, 'chmod', Utils.O644)
@@ -406,5 +408,9 @@ def post_run(self):
 def runnable_status(self):
 	return self.RUN_ME
 
-Task.task_factory('copy', vars=[], func=action_process_file_func)
+cls = Task.task_factory('copy', vars=[], func=action_process_file_func)
+cls.process_vars = ['fun', 'chmod', 'dict']
+
+PROCESS_SAFE = (copy_func, subst_func)
+"""functions of the copy tasks which may be sent to the worker processes, the other functions (lambdas, wscript functions) cannot be pickled"""
 
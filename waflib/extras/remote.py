@@ -0,0 +1,455 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Thomas Nagy, 2010 (ita)
+
+"""
+Execute the compilation tasks in worker processes reached through sockets
+
+The workers are started by the command "worker" in any project loading this tool::
+
+	def options(opt):
+		opt.tool_options('remote')
+
+	$ waf worker --worker-address=unix:/tmp/w1.sock &
+	$ waf worker --worker-address=127.0.0.1:7000 &
+	$ waf build -j16 --remote=unix:/tmp/w1.sock*4,127.0.0.1:7000*4
+
+The number after '*' is the amount of connections (jobs) opened to a worker.
+The tasks of the classes 'c' and 'cxx', and the tasks having the attribute
+'remote' set to True are sent to the workers; the tasks are executed locally
+when their files are not located under the project directories, or when no worker
+can be reached.
+
+Protocol: each message is a JSON header preceded by its length (8 hex digits), followed
+by the binary blobs whose sizes are listed in the header. The files are identified by
+content hash; a worker keeps the files it received or produced in a store, and the inputs
+are only sent when the worker does not have them already. The project paths are replaced
+by a placeholder in the command-line, so the worker runs the command in a temporary folder
+reproducing the layout of the files.
+
+The workers execute any command they receive: listen on a unix socket or on a trusted network only.
+"""
+
+import os, sys, re, socket, shutil, tempfile, threading, time
+try:
+	import json
+except ImportError:
+	json = None
+try:
+	from queue import Queue
+except ImportError:
+	from Queue import Queue
+from waflib import Task, Utils, Logs, Options, Context, Errors
+
+ROOT = '@ROOT@'
+"""placeholder for the project directory in the commands sent to the workers"""
+
+RETRY = 30
+"""seconds before connecting again to a worker that could not be reached"""
+
+remote_classes = ['c', 'cxx']
+"""task classes executed on the workers unless the attribute 'remote' is set"""
+
+def options(opt):
+	opt.add_option('--remote', action='store', default='', dest='remote',
+		help='workers executing the compilation tasks, e.g. "unix:/tmp/w.sock*4,host:7000*8"')
+	opt.add_option('--worker-address', action='store', dest='worker_address',
+		default='unix:' + os.path.join(tempfile.gettempdir(), 'waf-worker.sock'),
+		help='address the worker listens to (waf worker) [default: %default]')
+	opt.add_option('--worker-store', action='store', default='', dest='worker_store',
+		help='folder for the files kept by the worker (waf worker) [default: temporary]')
+
+# ------------------------------------------------------------------
+# protocol
+
+def connect(addr):
+	"open a socket to an address given as unix:PATH or HOST:PORT"
+	if addr.startswith('unix:'):
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		sock.connect(addr[5:])
+	else:
+		(host, port) = addr.rsplit(':', 1)
+		sock = socket.create_connection((host, int(port)))
+		sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+	return sock
+
+def listen(addr):
+	"create a server socket for an address given as unix:PATH or HOST:PORT"
+	if addr.startswith('unix:'):
+		path = addr[5:]
+		if os.path.exists(path):
+			os.remove(path)
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		sock.bind(path)
+	else:
+		(host, port) = addr.rsplit(':', 1)
+		sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		sock.bind((host, int(port)))
+	sock.listen(64)
+	return sock
+
+def recv_all(sock, size):
+	"read exactly size bytes"
+	buf = []
+	while size > 0:
+		data = sock.recv(min(size, 65536))
+		if not data:
+			raise EOFError('connection closed')
+		buf.append(data)
+		size -= len(data)
+	return b''.join(buf)
+
+def send_msg(sock, header, blobs=[]):
+	"send a header (dict) and a list of binary blobs"
+	header['blobs'] = [len(x) for x in blobs]
+	data = json.dumps(header).encode('utf-8')
+	sock.sendall(('%08x' % len(data)).encode('utf-8') + data + b''.join(blobs))
+
+def recv_msg(sock):
+	"receive a header (dict) and the list of binary blobs following it"
+	size = int(recv_all(sock, 8).decode('utf-8'), 16)
+	header = json.loads(recv_all(sock, size).decode('utf-8'))
+	blobs = [recv_all(sock, x) for x in header['blobs']]
+	return (header, blobs)
+
+# ------------------------------------------------------------------
+# worker side
+
+class store(object):
+	"files kept by the worker, by content hash"
+	def __init__(self, path):
+		self.path = path
+		self.lock = threading.Lock()
+
+	def get_path(self, h):
+		return os.path.join(self.path, h[:2], h)
+
+	def has(self, h):
+		return os.path.isfile(self.get_path(h))
+
+	def add(self, h, data):
+		path = self.get_path(h)
+		if os.path.isfile(path):
+			return
+		self.lock.acquire()
+		try:
+			Utils.check_dir(os.path.dirname(path))
+		finally:
+			self.lock.release()
+		# write to a temporary file first, other threads may read the same file
+		tmp = '%s.%d.%d' % (path, os.getpid(), id(threading.currentThread()))
+		f = open(tmp, 'wb')
+		try:
+			f.write(data)
+		finally:
+			f.close()
+		os.rename(tmp, path)
+
+	def add_file(self, filename):
+		"put a file in the store, return its hash"
+		h = Utils.to_hex(Utils.h_file(filename))
+		f = open(filename, 'rb')
+		try:
+			self.add(h, f.read())
+		finally:
+			f.close()
+		return h
+
+def subst_root(val, root):
+	"replace the placeholder by the working directory of a task"
+	if isinstance(val, list):
+		return [x.replace(ROOT, root) for x in val]
+	return val.replace(ROOT, root)
+
+def run_request(st, req, blobs):
+	"execute a command received from a client, return the reply (header, blobs)"
+	for (h, data) in zip(req['data'], blobs):
+		st.add(h, data)
+
+	root = tempfile.mkdtemp(prefix='task-', dir=st.path)
+	try:
+		for (path, h) in req['inputs']:
+			dest = os.path.join(root, path)
+			Utils.check_dir(os.path.dirname(dest))
+			try:
+				os.link(st.get_path(h), dest)
+			except OSError:
+				shutil.copy2(st.get_path(h), dest)
+		for path in req['outputs']:
+			Utils.check_dir(os.path.dirname(os.path.join(root, path)))
+
+		cwd = subst_root(req['cwd'], root)
+		Utils.check_dir(cwd)
+		env = req.get('env', None)
+		if env:
+			env = dict((k, subst_root(v, root)) for (k, v) in env.items())
+
+		cmd = subst_root(req['cmd'], root)
+		Logs.debug('runner: %r' % cmd)
+		try:
+			p = Utils.subprocess.Popen(cmd, shell=isinstance(cmd, str), cwd=cwd, env=env,
+				stdout=Utils.subprocess.PIPE, stderr=Utils.subprocess.PIPE)
+			(out, err) = p.communicate()
+			ret = p.returncode
+		except OSError as e:
+			(out, err, ret) = (b'', str(e).encode('utf-8'), -1)
+
+		outputs = []
+		data = []
+		if not ret:
+			for path in req['outputs']:
+				h = st.add_file(os.path.join(root, path))
+				f = open(st.get_path(h), 'rb')
+				try:
+					data.append(f.read())
+				finally:
+					f.close()
+				outputs.append(h)
+
+		# the outputs of the commands may be displayed by the client
+		out = out.decode('utf-8', 'replace').replace(root, ROOT)
+		err = err.decode('utf-8', 'replace').replace(root, ROOT)
+		return ({'ret': ret, 'out': out, 'err': err, 'outputs': outputs}, data)
+	finally:
+		shutil.rmtree(root, ignore_errors=True)
+
+def serve(st, conn):
+	"process the requests of a client until the connection is closed"
+	try:
+		while 1:
+			try:
+				(req, blobs) = recv_msg(conn)
+			except EOFError:
+				break
+			try:
+				if req['op'] == 'has':
+					send_msg(conn, {'missing': [h for h in req['hashes'] if not st.has(h)]})
+				elif req['op'] == 'run':
+					(rep, data) = run_request(st, req, blobs)
+					send_msg(conn, rep, data)
+				else:
+					send_msg(conn, {'error': 'unknown operation %r' % req['op']})
+			except Exception:
+				send_msg(conn, {'error': Utils.ex_stack()})
+	except (socket.error, EOFError) as e:
+		Logs.debug('runner: connection lost %r' % e)
+	finally:
+		conn.close()
+
+class WorkerContext(Context.Context):
+	"""runs a worker for remote builds (see waflib/extras/remote.py)"""
+	cmd = 'worker'
+
+	def execute(self):
+		if not json:
+			raise Errors.WafError('The module json is required by the workers (Python >= 2.6)')
+		addr = Options.options.worker_address
+		path = Options.options.worker_store or tempfile.mkdtemp(prefix='waf-worker-')
+		Utils.check_dir(path)
+		st = store(os.path.abspath(path))
+
+		sock = listen(addr)
+		Logs.info('Waf worker listening on %s (store %s)' % (addr, st.path))
+		try:
+			while 1:
+				(conn, a) = sock.accept()
+				t = threading.Thread(target=serve, args=(st, conn))
+				t.setDaemon(True)
+				t.start()
+		finally:
+			sock.close()
+
+# ------------------------------------------------------------------
+# client side
+
+class connection(object):
+	"socket to a worker, and the hashes of the files the worker has already"
+	def __init__(self, addr):
+		self.addr = addr
+		self.sock = None
+		self.known = set([])
+		self.retry = 0 # do not use the worker before this time
+
+	def request(self, header, blobs=[]):
+		if not self.sock:
+			self.sock = connect(self.addr)
+			self.known = set([])
+		send_msg(self.sock, header, blobs)
+		return recv_msg(self.sock)
+
+	def close(self):
+		if self.sock:
+			try:
+				self.sock.close()
+			except socket.error:
+				pass
+		self.sock = None
+
+pool = None
+pool_lock = threading.Lock()
+def get_pool():
+	"connections to the workers given by --remote, opened lazily"
+	global pool
+	pool_lock.acquire()
+	try:
+		if pool is None:
+			pool = Queue(0)
+			for x in Utils.to_list(getattr(Options.options, 'remote', '').replace(',', ' ')):
+				(addr, sep, count) = x.partition('*')
+				for i in range(int(count or 1)):
+					pool.put(connection(addr))
+	finally:
+		pool_lock.release()
+	return pool
+
+hashes = {}
+def get_hash(path):
+	"content hash of a file, cached by timestamp and size"
+	st = os.stat(path)
+	try:
+		(stamp, size, h) = hashes[path]
+		if stamp == st.st_mtime and size == st.st_size:
+			return h
+	except KeyError:
+		pass
+	h = Utils.to_hex(Utils.h_file(path))
+	hashes[path] = (st.st_mtime, st.st_size, h)
+	return h
+
+def read_file(path):
+	f = open(path, 'rb')
+	try:
+		return f.read()
+	finally:
+		f.close()
+
+def get_root(bld):
+	"directory containing the source and the build directories, replaced by ROOT on the workers"
+	try:
+		return bld.remote_root
+	except AttributeError:
+		src = bld.srcnode.abspath().split(os.sep)
+		out = bld.bldnode.abspath().split(os.sep)
+		i = 0
+		while i < min(len(src), len(out)) and src[i] == out[i]:
+			i += 1
+		bld.remote_root = os.sep.join(src[:i]) or os.sep
+		return bld.remote_root
+
+def make_request(tsk, cmd, kw):
+	"""
+	create the request for a command, or return None if a file is located out of the project
+	(all the paths are relative to the root, see get_root)
+	"""
+	bld = tsk.generator.bld
+	root = get_root(bld)
+	reg = re.compile(re.escape(root) + r'(?=$|[\\/])')
+	def rel(node):
+		path = node.abspath()
+		if not reg.match(path):
+			raise ValueError(path)
+		return path[len(root):].lstrip(os.sep)
+	def subst(val):
+		if isinstance(val, list):
+			return [reg.sub(ROOT, x) for x in val]
+		return reg.sub(ROOT, val)
+
+	try:
+		nodes = tsk.inputs + bld.node_deps.get(tsk.uid(), [])
+		inputs = [(rel(x), x.abspath()) for x in nodes]
+		outputs = [rel(x) for x in tsk.outputs]
+	except ValueError:
+		return None
+
+	req = {'op': 'run', 'cmd': subst(cmd), 'cwd': subst(kw.get('cwd') or bld.variant_dir), 'outputs': outputs}
+	if kw.get('env'):
+		req['env'] = dict((k, subst(v)) for (k, v) in kw['env'].items())
+	return (req, inputs)
+
+def remote_command(tsk, conn, cmd, kw):
+	"""
+	execute a command on a worker, return the exit status, or None if it must be executed locally
+	"""
+	ret = make_request(tsk, cmd, kw)
+	if not ret:
+		return None
+	(req, inputs) = ret
+
+	files = {}
+	for (path, abspath) in inputs:
+		files[get_hash(abspath)] = abspath
+	req['inputs'] = [(path, get_hash(abspath)) for (path, abspath) in inputs]
+
+	# only the files the worker does not have cross the wire
+	lst = [h for h in files if not h in conn.known]
+	if lst:
+		(rep, blobs) = conn.request({'op': 'has', 'hashes': lst})
+		conn.known.update(lst)
+		lst = rep['missing']
+	req['data'] = lst
+	(rep, blobs) = conn.request(req, [read_file(files[h]) for h in lst])
+
+	if 'error' in rep:
+		Logs.warn('remote execution failed on %s, running %r locally\n%s' % (conn.addr, tsk, rep['error']))
+		return None
+
+	bld = tsk.generator.bld
+	root = get_root(bld)
+	for (node, h, data) in zip(tsk.outputs, rep['outputs'], blobs):
+		path = node.abspath()
+		Utils.check_dir(os.path.dirname(path))
+		f = open(path, 'wb')
+		try:
+			f.write(data)
+		finally:
+			f.close()
+		conn.known.add(h)
+		st = os.stat(path)
+		hashes[path] = (st.st_mtime, st.st_size, h)
+
+	for (txt, stream) in ((rep['out'], sys.stdout), (rep['err'], sys.stderr)):
+		if txt:
+			txt = txt.replace(ROOT, root)
+			if bld.logger:
+				bld.logger.debug('out: %s' % txt)
+			else:
+				stream.write(txt)
+	return rep['ret']
+
+def exec_command(self, cmd, **kw):
+	"""
+	execute the commands of the remote tasks on the workers, the other tasks run locally
+	"""
+	remote = self.remote
+	if remote is None:
+		remote = self.__class__.__name__ in remote_classes
+	if not remote or not json or not getattr(Options.options, 'remote', ''):
+		return self.exec_command_local(cmd, **kw)
+
+	bld = self.generator.bld
+	if not kw.get('cwd', None):
+		kw['cwd'] = bld.variant_dir
+	Logs.debug('runner: %r (remote)' % cmd)
+
+	q = get_pool()
+	conn = q.get()
+	ret = None
+	try:
+		if conn.retry < time.time():
+			try:
+				ret = remote_command(self, conn, cmd, kw)
+			except (socket.error, EOFError, ValueError, KeyError) as e:
+				Logs.warn('worker %s unavailable (%r), running the tasks locally' % (conn.addr, e))
+				conn.close()
+				conn.retry = time.time() + RETRY
+	finally:
+		q.put(conn)
+
+	if ret is None:
+		return self.exec_command_local(cmd, **kw)
+	return ret
+
+Task.TaskBase.remote = None # True or False to override remote_classes
+Task.TaskBase.exec_command_local = Task.TaskBase.exec_command
+Task.TaskBase.exec_command = exec_command
@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# Thomas Nagy, 2010 (ita)
+
+"""
+Rebuild the project each time a source file changes::
+
+	def options(opt):
+		opt.tool_options('watch')
+
+	$ waf watch
+
+The build context is kept in memory between the builds (task generators, tasks, signatures,
+node tree and preprocessor caches). The source folders are watched through inotify (Linux,
+through ctypes), and the files used by the tasks are polled when inotify is not available.
+
+When files change, only the signatures of the corresponding nodes are computed again,
+and only the tasks depending on them (and on their outputs) are considered for execution.
+The build is restarted from scratch when a wscript file changes. The files created
+after the start are only noticed if a task includes them (c/c++ headers); the new source
+files of a glob require a change of the wscript file.
+"""
+
+import os, sys, time, struct, select
+try:
+	import ctypes, ctypes.util
+except ImportError:
+	ctypes = None
+from waflib import Build, Context, Task, Node, Options, Logs, Errors, Utils
+
+DELAY = 0.05
+"""time to wait for more events before rebuilding (editors may write several files)"""
+
+POLL_DELAY = 1.0
+"""interval between two polls, when inotify is not available"""
+
+IN_MODIFY      = 0x00000002
+IN_ATTRIB      = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_Q_OVERFLOW  = 0x00004000
+IN_IGNORED     = 0x00008000
+IN_ISDIR       = 0x40000000
+
+MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+ALL = None
+"""returned by the watchers when the events were lost, all the files must be checked"""
+
+class inotify_watcher(object):
+	"watch folders with inotify(7), through ctypes"
+	def __init__(self, dirs, prune):
+		if not ctypes or not sys.platform.startswith('linux'):
+			raise OSError('inotify is not available')
+		self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+		self.fd = self.libc.inotify_init()
+		if self.fd < 0:
+			raise OSError(ctypes.get_errno(), 'inotify_init failed')
+		self.prune = prune
+		self.wds = {}
+		for x in dirs:
+			self.add_tree(x)
+
+	def add_tree(self, path):
+		"watch a folder and its sub-folders, return the files found"
+		ret = []
+		for (dirpath, dirnames, filenames) in os.walk(path):
+			dirnames[:] = [x for x in dirnames if not self.prune(os.path.join(dirpath, x))]
+			wd = self.libc.inotify_add_watch(self.fd, dirpath.encode(), MASK)
+			if wd < 0:
+				Logs.warn('Cannot watch %r (increase fs.inotify.max_user_watches?)' % dirpath)
+				continue
+			self.wds[wd] = dirpath
+			ret.extend([os.path.join(dirpath, x) for x in filenames])
+		return ret
+
+	def read(self, changed):
+		"add the paths of the events read to the set changed, return False on overflow"
+		buf = os.read(self.fd, 65536)
+		pos = 0
+		while pos < len(buf):
+			(wd, mask, cookie, ln) = struct.unpack_from('iIII', buf, pos)
+			name = buf[pos + 16 : pos + 16 + ln].rstrip(b'\0')
+			pos += 16 + ln
+
+			if mask & IN_Q_OVERFLOW:
+				return False
+			if mask & IN_IGNORED:
+				self.wds.pop(wd, None)
+				continue
+			try:
+				path = os.path.join(self.wds[wd], name.decode(sys.getfilesystemencoding() or 'utf-8'))
+			except KeyError:
+				continue
+			if mask & IN_ISDIR:
+				if mask & (IN_CREATE | IN_MOVED_TO) and not self.prune(path):
+					changed.update(self.add_tree(path))
+				continue
+			changed.add(path)
+		return True
+
+	def wait(self):
+		"wait for changes, return the set of paths changed (or ALL)"
+		changed = set([])
+		ok = True
+		select.select([self.fd], [], [])
+		while True:
+			ok = self.read(changed) and ok
+			if not select.select([self.fd], [], [], DELAY)[0]:
+				break
+		if not ok:
+			return ALL
+		return changed
+
+	def close(self):
+		os.close(self.fd)
+
+class poll_watcher(object):
+	"stat the files used by the build periodically"
+	def __init__(self, files):
+		self.files = {}
+		self.update(files)
+
+	def stat(self, path):
+		try:
+			st = os.stat(path)
+		except OSError:
+			return None
+		return (st.st_mtime, st.st_size)
+
+	def update(self, files):
+		"files to watch in addition to the ones already watched"
+		for x in files:
+			if not x in self.files:
+				self.files[x] = self.stat(x)
+
+	def wait(self):
+		while True:
+			time.sleep(POLL_DELAY)
+			changed = set([])
+			for (path, st) in self.files.items():
+				new = self.stat(path)
+				if new != st:
+					self.files[path] = new
+					changed.add(path)
+			if changed:
+				return changed
+
+	def close(self):
+		pass
+
+class WatchContext(Build.BuildContext):
+	'''executes the build each time a source file changes'''
+	cmd = 'watch'
+
+	def execute(self):
+		"""see Context.execute"""
+		self.load()
+		if not self.all_envs:
+			self.load_envs()
+
+		self.wscripts = set([])
+		Logs.info("Waf: Entering directory `%s'" % self.variant_dir)
+		self.recurse([self.run_dir])
+		self.pre_build()
+		self.compile_once()
+
+		self.watcher = self.get_watcher()
+		try:
+			while True:
+				changed = self.watcher.wait()
+				if changed is not ALL and self.wscripts.intersection(changed):
+					# the task generators may be different, start over
+					Logs.info('Waf: a wscript file changed, reloading the project')
+					for x in self.wscripts:
+						Context.cache_modules.pop(x, None)
+					Options.commands.insert(0, self.cmd)
+					return
+				if self.update_tasks(changed):
+					self.compile_once()
+		finally:
+			self.watcher.close()
+
+	def pre_recurse(self, node):
+		super(WatchContext, self).pre_recurse(node)
+		self.wscripts.add(node.abspath())
+
+	def get_watcher(self):
+		"watch the source folders with inotify if possible, else poll the files used by the tasks"
+		bld = self.bldnode.abspath()
+		def prune(path):
+			name = os.path.basename(path)
+			return path == bld or name.startswith('.') or name in Node.prune_pats
+		try:
+			ret = inotify_watcher([self.srcnode.abspath()], prune)
+		except (OSError, AttributeError) as e:
+			Logs.debug('watch: inotify is not available (%s), polling the files' % e)
+			ret = poll_watcher(self.wscripts)
+			ret.update([x.abspath() for x in self.get_source_nodes()])
+			self.poller = ret
+		Logs.info('Waf: Watching the files for changes, press ctrl+c to stop')
+		return ret
+
+	def compile_once(self):
+		"run the build, the errors are displayed but do not stop the loop"
+		self.timer = Utils.Timer()
+		try:
+			self.compile()
+		except Errors.BuildError as e:
+			Logs.error(e.msg)
+		else:
+			self.post_build()
+			Logs.info('Build finished successfully (%s)' % self.timer)
+		poller = getattr(self, 'poller', None)
+		if poller:
+			poller.update([x.abspath() for x in self.get_source_nodes()])
+
+	def get_tasks(self):
+		"all the tasks created so far"
+		for g in self.groups:
+			for tg in g:
+				if isinstance(tg, Task.TaskBase):
+					yield tg
+				else:
+					for tsk in getattr(tg, 'tasks', []):
+						yield tsk
+
+	def get_deps(self, tsk):
+		"nodes used by a task"
+		ret = tsk.inputs + getattr(tsk, 'dep_nodes', []) + getattr(tsk, 'deps_nodes', [])
+		try:
+			ret = ret + self.node_deps[tsk.uid()]
+		except KeyError:
+			pass
+		if self.deps_man:
+			for x in tsk.inputs + tsk.outputs:
+				ret = ret + [y for y in self.deps_man.get(id(x), []) if isinstance(y, Node.Node)]
+		return ret
+
+	def get_source_nodes(self):
+		"source files used by the tasks (for polling)"
+		ret = set([])
+		for tsk in self.get_tasks():
+			ret.update([x for x in self.get_deps(tsk) if not x.is_bld()])
+		return ret
+
+	def search_node(self, path):
+		"node corresponding to an absolute path, if it is in the tree already (no file system access)"
+		cur = self.root
+		for x in Node.split_path(path):
+			if not x:
+				continue
+			try:
+				cur = cur.children[x]
+			except (AttributeError, KeyError):
+				return None
+		return cur
+
+	def update_tasks(self, changed):
+		"""
+		forget the signatures of the nodes changed, and mark the tasks depending
+		on them to run again; the other tasks are marked as skipped
+		"""
+		pc = getattr(self, 'parse_cache', {})
+		nodes = set([])
+		new = []
+		if changed is ALL:
+			Logs.debug('watch: events were lost, checking all the files')
+			self.hash_cache = {}
+			pc.clear()
+		else:
+			hc = getattr(self, 'hash_cache', {})
+			for path in changed:
+				pc.pop(path, None)
+				node = self.search_node(path)
+				if node:
+					hc.pop(id(node), None)
+					nodes.add(id(node))
+				else:
+					new.append(path.replace(os.sep, '/'))
+			if new:
+				# headers might be found at different locations
+				self.cache_nd = {}
+
+		# consumers of the nodes -> tasks
+		users = {}
+		tasks = list(self.get_tasks())
+		for tsk in tasks:
+			for x in self.get_deps(tsk):
+				try:
+					users[id(x)].append(tsk)
+				except KeyError:
+					users[id(x)] = [tsk]
+
+		todo = set([])
+		for tsk in tasks:
+			if changed is ALL:
+				todo.add(tsk)
+				continue
+			for name in self.raw_deps.get(tsk.uid(), []):
+				if isinstance(name, str) and [x for x in new if x.endswith('/' + name)]:
+					# an include that was not found may be there now
+					self.task_sigs.pop((tsk.uid(), 'imp'), None)
+					todo.add(tsk)
+					break
+
+		# and the consumers of their outputs
+		lst = list(nodes)
+		for tsk in todo:
+			lst.extend([id(x) for x in tsk.outputs])
+		while lst:
+			for tsk in users.get(lst.pop(), []):
+				if not tsk in todo:
+					todo.add(tsk)
+					lst.extend([id(x) for x in tsk.outputs])
+
+		if not todo:
+			return todo
+
+		# the tasks that failed are run again too
+		for tsk in tasks:
+			if not tsk.hasrun in (Task.SUCCESS, Task.SKIPPED):
+				todo.add(tsk)
+
+		for tsk in tasks:
+			if tsk in todo:
+				tsk.hasrun = Task.NOT_RUN
+				try:
+					del tsk.cache_sig
+				except AttributeError:
+					pass
+			else:
+				tsk.hasrun = Task.SKIPPED
+
+		if todo:
+			Logs.info('Waf: %d task(s) to check' % len(todo))
+		return todo